@@ -90,6 +90,7 @@ finally:
     from uuid import uuid4
     from pathlib import Path
     from time import strftime
+    from nibabel.openers import Opener
     from nipype import logging as nlogging, __version__ as _nipype_ver
     from templateflow import __version__ as _tf_ver
     from . import __version__
@@ -119,6 +120,10 @@ logging.addLevelName(15, "VERBOSE")  # Add a new level between INFO and DEBUG
 
 DEFAULT_MEMORY_MIN_GB = 0.01
 
+# Raise NiBabel's gzip level (default: 1) for intermediate ``.nii.gz`` files.
+# Set at import time so worker processes (which import this module) pick it up too.
+Opener.default_compresslevel = int(os.getenv("FMRIPREP_GZIP_LEVEL", "5"))
+
 # Ping NiPype eTelemetry once if env var was not set
 # workers on the pool will have the env variable set from the master process
 if not _disable_et:
@@ -349,6 +354,9 @@ class execution(_Config):
     """A path where anatomical derivatives are found to fast-track *sMRIPrep*."""
     bids_dir = None
     """An existing path to the dataset, which must be BIDS-compliant."""
+    bids_database_dir = None
+    """Path to a directory containing an SQLite database of the indexed BIDS dataset,
+    reused across processes of the same run (see :py:func:`init`)."""
     bids_description_hash = None
     """Checksum (SHA256) of the ``dataset_description.json`` of the BIDS dataset."""
     bids_filters = None
@@ -399,6 +407,7 @@ class execution(_Config):
 
     _paths = (
         "anat_derivatives",
+        "bids_database_dir",
         "bids_dir",
         "fs_license_file",
         "fs_subjects_dir",
@@ -419,12 +428,17 @@ class execution(_Config):
             import re
             from bids.layout import BIDSLayout
 
-            work_dir = cls.work_dir / "bids.db"
-            work_dir.mkdir(exist_ok=True, parents=True)
+            # Index the dataset once per run: processes spawned later on (e.g., to
+            # build the workflow) load the config and reuse the same database.
+            _db_path = cls.bids_database_dir or (
+                cls.work_dir / cls.run_uuid / "bids_db"
+            )
+            _db_path.mkdir(exist_ok=True, parents=True)
             cls._layout = BIDSLayout(
                 str(cls.bids_dir),
                 validate=False,
-                # database_path=str(work_dir),
+                database_path=str(_db_path),
+                reset_database=cls.bids_database_dir is None,
                 ignore=(
                     "code",
                     "stimuli",
@@ -434,6 +448,7 @@ class execution(_Config):
                     re.compile(r"^\."),
                 ),
             )
+            cls.bids_database_dir = _db_path
         cls.layout = cls._layout
         if cls.bids_filters:
             from bids.layout import Query
@@ -5,7 +5,7 @@
 from niworkflows.interfaces import bids, cifti, freesurfer, images, itk, surf, utility
 
 from .reports import SubjectSummary, FunctionalSummary, AboutSummary
-from .confounds import GatherConfounds, ICAConfounds, FMRISummary
+from .confounds import GatherConfounds, ICAConfounds, JoinConfounds, FMRISummary
 from .multiecho import T2SMap
 
 
@@ -26,6 +26,7 @@ __all__ = [
     "AboutSummary",
     "GatherConfounds",
     "ICAConfounds",
+    "JoinConfounds",
     "FMRISummary",
     "T2SMap",
     "DerivativesDataSink",
@@ -33,12 +33,21 @@ class GatherConfoundsInputSpec(BaseInterfaceInputSpec):
     signals = File(exists=True, desc="input signals")
     dvars = File(exists=True, desc="file containing DVARS")
     std_dvars = File(exists=True, desc="file containing standardized DVARS")
+    dvars_columns = traits.List(
+        traits.Str, desc="column names, if the DVARS file has no header"
+    )
+    std_dvars_columns = traits.List(
+        traits.Str, desc="column names, if the standardized DVARS file has no header"
+    )
     fd = File(exists=True, desc="input framewise displacement")
     # rmsd = File(exists=True, desc="input RMS framewise displacement")
     tcompcor = File(exists=True, desc="input tCompCorr")
     acompcor = File(exists=True, desc="input aCompCorr")
     cos_basis = File(exists=True, desc="input cosine basis")
     motion = File(exists=True, desc="input motion parameters")
+    motion_columns = traits.List(
+        traits.Str, desc="column names, if the motion parameters file has no header"
+    )
     aroma = File(exists=True, desc="input ICA-AROMA")
 
 
@@ -94,6 +103,9 @@ class GatherConfounds(SimpleInterface):
             cos_basis=self.inputs.cos_basis,
             motion=self.inputs.motion,
             aroma=self.inputs.aroma,
+            dvars_columns=self.inputs.dvars_columns or None,
+            std_dvars_columns=self.inputs.std_dvars_columns or None,
+            motion_columns=self.inputs.motion_columns or None,
             newpath=runtime.cwd,
         )
         self._results["confounds_file"] = combined_out
@@ -148,6 +160,82 @@ class ICAConfounds(SimpleInterface):
         return runtime
 
 
+class JoinConfoundsInputSpec(BaseInterfaceInputSpec):
+    in_file = File(exists=True, mandatory=True, desc="input confounds file")
+    join_file = traits.Either(
+        None, File(exists=True), mandatory=True, desc="confounds file to be adjoined"
+    )
+
+
+class JoinConfoundsOutputSpec(TraitedSpec):
+    out_file = File(exists=True, desc="output confounds file")
+
+
+class JoinConfounds(SimpleInterface):
+    r"""
+    Join the columns of two confounds files, if ``join_file`` is not ``None``.
+
+    .. testsetup::
+
+    >>> from tempfile import TemporaryDirectory
+    >>> tmpdir = TemporaryDirectory()
+    >>> os.chdir(tmpdir.name)
+
+    .. doctest::
+
+    >>> pd.DataFrame({'a': [0.1, 0.3]}).to_csv('confounds.tsv', sep='\t', index=False)
+    >>> pd.DataFrame({'b': ['n/a', 0.2]}).to_csv('aroma.tsv', sep='\t', index=False)
+
+    >>> join = JoinConfounds(in_file='confounds.tsv', join_file='aroma.tsv')
+    >>> res = join.run()
+    >>> print(open(res.outputs.out_file).read().strip())  # doctest: +NORMALIZE_WHITESPACE
+    a    b
+    0.1  n/a
+    0.3  0.2
+
+    >>> res = JoinConfounds(in_file='confounds.tsv', join_file=None).run()
+    >>> os.path.basename(res.outputs.out_file)
+    'confounds.tsv'
+
+    .. testcleanup::
+
+    >>> tmpdir.cleanup()
+
+    """
+    input_spec = JoinConfoundsInputSpec
+    output_spec = JoinConfoundsOutputSpec
+
+    def _run_interface(self, runtime):
+        self._results["out_file"] = _join_confounds(
+            self.inputs.in_file, self.inputs.join_file, newpath=runtime.cwd
+        )
+        return runtime
+
+
+def _join_confounds(in_file, join_file, newpath=None):
+    """Join two TSV files side by side, passing all values through as text."""
+    if join_file is None or os.path.samefile(in_file, join_file):
+        return in_file
+
+    # Read everything as text: columns are passed through untouched
+    read_kwargs = dict(sep="\t", engine="c", dtype=str, na_filter=False)
+    data = pd.read_csv(in_file, **read_kwargs)
+    join = pd.read_csv(join_file, **read_kwargs)
+    if len(data) != len(join):
+        raise ValueError("Number of rows in datasets do not match")
+
+    if newpath is None:
+        newpath = os.getcwd()
+
+    out_file = fname_presuffix(
+        in_file, suffix="_joined.tsv", newpath=newpath, use_ext=False
+    )
+    # A large buffer keeps the number of write calls low on networked filesystems
+    with open(out_file, "w", newline="", buffering=1 << 20) as fh:
+        pd.concat((data, join), axis=1).to_csv(fh, sep="\t", index=False)
+    return out_file
+
+
 def _gather_confounds(
     signals=None,
     dvars=None,
@@ -158,12 +246,19 @@ def _gather_confounds(
     cos_basis=None,
     motion=None,
     aroma=None,
+    dvars_columns=None,
+    std_dvars_columns=None,
+    motion_columns=None,
     newpath=None,
 ):
     r"""
     Load confounds from the filenames, concatenate together horizontally
     and save new file.
 
+    Files with no header (e.g., as written by ``np.savetxt``) are read
+    directly when their column names are given with the ``*_columns``
+    arguments.
+
     >>> from tempfile import TemporaryDirectory
     >>> tmpdir = TemporaryDirectory()
     >>> os.chdir(tmpdir.name)
@@ -177,6 +272,12 @@ def _gather_confounds(
     ...             engine='python')  # doctest: +NORMALIZE_WHITESPACE
        global_signal  std_dvars
     0            0.1        0.2
+
+    >>> np.savetxt('movpar.txt', [[0.1, 0.2, 0.3]])
+    >>> out_file, confound_list = _gather_confounds(
+    ...     motion='movpar.txt', motion_columns=['trans_x', 'trans_y', 'trans_z'])
+    >>> pd.read_csv(out_file, sep='\t').columns.tolist()
+    ['trans_x', 'trans_y', 'trans_z']
     >>> tmpdir.cleanup()
 
 
@@ -203,26 +304,29 @@ def _gather_confounds(
 
     all_files = []
     confounds_list = []
-    for confound, name in (
-        (signals, "Global signals"),
-        (std_dvars, "Standardized DVARS"),
-        (dvars, "DVARS"),
-        (fdisp, "Framewise displacement"),
-        # (rmsd, "Framewise displacement (RMS)"),
-        (tcompcor, "tCompCor"),
-        (acompcor, "aCompCor"),
-        (cos_basis, "Cosine basis"),
-        (motion, "Motion parameters"),
-        (aroma, "ICA-AROMA"),
+    for confound, name, columns in (
+        (signals, "Global signals", None),
+        (std_dvars, "Standardized DVARS", std_dvars_columns),
+        (dvars, "DVARS", dvars_columns),
+        (fdisp, "Framewise displacement", None),
+        # (rmsd, "Framewise displacement (RMS)", None),
+        (tcompcor, "tCompCor", None),
+        (acompcor, "aCompCor", None),
+        (cos_basis, "Cosine basis", None),
+        (motion, "Motion parameters", motion_columns),
+        (aroma, "ICA-AROMA", None),
     ):
         if confound is not None and isdefined(confound):
             confounds_list.append(name)
             if os.path.exists(confound) and os.stat(confound).st_size > 0:
-                all_files.append(confound)
+                all_files.append((confound, columns))
 
     confounds_data = pd.DataFrame()
-    for file_name in all_files:  # assumes they all have headings already
-        new = pd.read_csv(file_name, sep="\t")
+    for file_name, columns in all_files:
+        if columns is None:  # assumes it has headings already
+            new = pd.read_csv(file_name, sep="\t")
+        else:
+            new = pd.read_csv(file_name, sep=r"\s+", header=None, names=columns)
         for column_name in new.columns:
             new.rename(
                 columns={column_name: camel_to_snake(less_breakable(column_name))},
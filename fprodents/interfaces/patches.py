@@ -7,14 +7,363 @@ Temporary patches
 
 """
 
+import os
+from collections import OrderedDict
+from itertools import chain
 from random import randint
 from time import sleep
 
-from numpy.linalg.linalg import LinAlgError
+import numpy as np
+import nibabel as nb
+from numpy.linalg import LinAlgError
+from nipype import logging
 from nipype.algorithms import confounds as nac
-from nipype.interfaces.base import traits
+from nipype.interfaces.base import isdefined, traits
 from nipype.interfaces.fsl.preprocess import FAST, FASTInputSpec
 
+LOGGER = logging.getLogger("nipype.interface")
+
+
+def _compcor_svd(a, full_matrices=True, compute_uv=True):
+    """
+    Singular values and left singular vectors of a wide matrix.
+
+    CompCor decomposes a (time x voxels) matrix with many more voxels than
+    timepoints, and only keeps ``u`` and ``s``.
+    Factoring ``a.T = Q R`` reduces the problem to the SVD of the small
+    (time x time) factor ``R.T``, which shares them with ``a`` without
+    squaring its condition number (as the Gram matrix ``a @ a.T`` would).
+    ``Q`` is never formed, so the right singular vectors are not returned.
+
+    >>> a = np.random.default_rng(0).standard_normal((10, 200))
+    >>> u, s, vt = _compcor_svd(a, full_matrices=False)
+    >>> np.allclose(s, np.linalg.svd(a, compute_uv=False))
+    True
+    >>> np.allclose(u.T @ u, np.eye(10)), vt is None
+    (True, True)
+
+    """
+    if full_matrices or a.shape[0] > a.shape[1]:
+        return nac.fallback_svd(a, full_matrices=full_matrices, compute_uv=compute_uv)
+
+    r = np.linalg.qr(a.T, mode="r")
+    if not compute_uv:
+        return nac.fallback_svd(r.T, full_matrices=False, compute_uv=False)
+
+    u, s, _ = nac.fallback_svd(r.T, full_matrices=False)
+    return u, s, None
+
+
+def _run_compcor(interface, runtime, svd=_compcor_svd):
+    """
+    Run a nipype CompCor interface, decomposing its noise ROIs with ``svd``.
+
+    Vendored from :py:meth:`nipype.algorithms.confounds.CompCor._run_interface`
+    (nipype 1.7), calling :py:func:`compute_noise_components` below.
+
+    """
+    inputs = interface.inputs
+    mask_images = []
+    if isdefined(inputs.mask_files):
+        mask_images = nac.combine_mask_files(
+            inputs.mask_files, inputs.merge_method, inputs.mask_index
+        )
+
+    if inputs.use_regress_poly:
+        inputs.pre_filter = "polynomial"
+
+    # Degree 0 == remove mean; see compute_noise_components
+    degree = inputs.regress_poly_degree if inputs.pre_filter == "polynomial" else 0
+
+    imgseries = nb.load(inputs.realigned_file)
+
+    if len(imgseries.shape) != 4:
+        raise ValueError(
+            "{} expected a 4-D nifti file. Input {} has "
+            "{} dimensions (shape {})".format(
+                interface._header,
+                inputs.realigned_file,
+                len(imgseries.shape),
+                imgseries.shape,
+            )
+        )
+
+    if len(mask_images) == 0:
+        img = nb.Nifti1Image(
+            np.ones(imgseries.shape[:3], dtype=bool),
+            affine=imgseries.affine,
+            header=imgseries.header,
+        )
+        mask_images = [img]
+
+    skip_vols = inputs.ignore_initial_volumes
+    if skip_vols:
+        imgseries = imgseries.__class__(
+            imgseries.dataobj[..., skip_vols:], imgseries.affine, imgseries.header
+        )
+
+    mask_images = interface._process_masks(mask_images, imgseries.dataobj)
+
+    TR = 0
+    if inputs.pre_filter == "cosine":
+        if isdefined(inputs.repetition_time):
+            TR = inputs.repetition_time
+        else:
+            # Derive TR from NIfTI header, if possible
+            try:
+                TR = imgseries.header.get_zooms()[3]
+                if imgseries.header.get_xyzt_units()[1] == "msec":
+                    TR /= 1000
+            except (AttributeError, IndexError):
+                TR = 0
+
+            if TR == 0:
+                raise ValueError(
+                    "{} cannot detect repetition time from image - "
+                    "Set the repetition_time input".format(interface._header)
+                )
+
+    if isdefined(inputs.variance_threshold):
+        components_criterion = inputs.variance_threshold
+    elif isdefined(inputs.num_components):
+        components_criterion = inputs.num_components
+    else:
+        components_criterion = 6
+        LOGGER.warning(
+            "`num_components` and `variance_threshold` are "
+            "not defined. Setting number of components to 6 "
+            "for backward compatibility. Please set either "
+            "`num_components` or `variance_threshold`, as "
+            "this feature may be deprecated in the future."
+        )
+
+    components, filter_basis, metadata = compute_noise_components(
+        imgseries.get_fdata(dtype=np.float32),
+        mask_images,
+        components_criterion,
+        inputs.pre_filter,
+        degree,
+        inputs.high_pass_cutoff,
+        TR,
+        inputs.failure_mode,
+        inputs.mask_names,
+        svd=svd,
+    )
+
+    if skip_vols:
+        old_comp = components
+        nrows = skip_vols + components.shape[0]
+        components = np.zeros((nrows, components.shape[1]), dtype=components.dtype)
+        components[skip_vols:] = old_comp
+
+    components_file = os.path.join(os.getcwd(), inputs.components_file)
+    components_header = interface._make_headers(components.shape[1])
+    np.savetxt(
+        components_file,
+        components,
+        fmt="%.10f",
+        delimiter="\t",
+        header="\t".join(components_header),
+        comments="",
+    )
+    interface._results["components_file"] = os.path.join(
+        runtime.cwd, inputs.components_file
+    )
+
+    save_pre_filter = False
+    if inputs.pre_filter in ["polynomial", "cosine"]:
+        save_pre_filter = inputs.save_pre_filter
+
+    if save_pre_filter:
+        interface._results["pre_filter_file"] = save_pre_filter
+        if save_pre_filter is True:
+            interface._results["pre_filter_file"] = os.path.join(
+                runtime.cwd, "pre_filter.tsv"
+            )
+
+        ftype = {"polynomial": "Legendre", "cosine": "Cosine"}[inputs.pre_filter]
+        ncols = filter_basis.shape[1] if filter_basis.size > 0 else 0
+        header = ["{}{:02d}".format(ftype, i) for i in range(ncols)]
+        if skip_vols:
+            old_basis = filter_basis
+            # nrows defined above
+            filter_basis = np.zeros(
+                (nrows, ncols + skip_vols), dtype=filter_basis.dtype
+            )
+            if old_basis.size > 0:
+                filter_basis[skip_vols:, :ncols] = old_basis
+            filter_basis[:skip_vols, -skip_vols:] = np.eye(skip_vols)
+            header.extend(
+                ["NonSteadyStateOutlier{:02d}".format(i) for i in range(skip_vols)]
+            )
+        np.savetxt(
+            interface._results["pre_filter_file"],
+            filter_basis,
+            fmt="%.10f",
+            delimiter="\t",
+            header="\t".join(header),
+            comments="",
+        )
+
+    metadata_file = inputs.save_metadata
+    if metadata_file:
+        interface._results["metadata_file"] = metadata_file
+        if metadata_file is True:
+            interface._results["metadata_file"] = os.path.join(
+                runtime.cwd, "component_metadata.tsv"
+            )
+        components_names = np.empty(len(metadata["mask"]), dtype="object_")
+        retained = np.where(metadata["retained"])
+        not_retained = np.where(np.logical_not(metadata["retained"]))
+        components_names[retained] = components_header
+        components_names[not_retained] = [
+            "dropped{}".format(i) for i in range(len(not_retained[0]))
+        ]
+        with open(interface._results["metadata_file"], "w") as f:
+            f.write("\t".join(["component"] + list(metadata.keys())) + "\n")
+            for i in zip(components_names, *metadata.values()):
+                f.write(
+                    "{0[0]}\t{0[1]}\t{0[2]:.10f}\t"
+                    "{0[3]:.10f}\t{0[4]:.10f}\t{0[5]}\n".format(i)
+                )
+
+    return runtime
+
+
+def compute_noise_components(
+    imgseries,
+    mask_images,
+    components_criterion=0.5,
+    filter_type=False,
+    degree=0,
+    period_cut=128,
+    repetition_time=None,
+    failure_mode="error",
+    mask_names=None,
+    svd=_compcor_svd,
+):
+    """
+    Compute the noise components from the image series for each mask.
+
+    Vendored from :py:func:`nipype.algorithms.confounds.compute_noise_components`
+    (nipype 1.7), with the decomposition of each ROI delegated to ``svd``
+    (a callable with the signature of :py:func:`numpy.linalg.svd`, of which
+    only ``u`` and ``s`` are used).
+    See nipype's documentation for the other parameters and the outputs.
+
+    """
+    basis = np.array([])
+    if components_criterion == "all":
+        components_criterion = -1
+    mask_names = mask_names or range(len(mask_images))
+
+    components = []
+    md_mask = []
+    md_sv = []
+    md_var = []
+    md_cumvar = []
+    md_retained = []
+
+    for name, img in zip(mask_names, mask_images):
+        mask = np.asanyarray(nb.squeeze_image(img).dataobj).astype(bool)
+        if imgseries.shape[:3] != mask.shape:
+            raise ValueError(
+                "Inputs for CompCor, timeseries and mask, do not have "
+                "matching spatial dimensions ({} and {}, respectively)".format(
+                    imgseries.shape[:3], mask.shape
+                )
+            )
+
+        voxel_timecourses = imgseries[mask, :]
+
+        # Zero-out any bad values
+        voxel_timecourses[np.isnan(np.sum(voxel_timecourses, axis=1)), :] = 0
+
+        # Currently support Legendre-polynomial or cosine or detrending
+        # With no filter, the mean is nonetheless removed (poly w/ degree 0)
+        if filter_type == "cosine":
+            if repetition_time is None:
+                raise ValueError("Repetition time must be provided for cosine filter")
+            voxel_timecourses, basis = nac.cosine_filter(
+                voxel_timecourses,
+                repetition_time,
+                period_cut,
+                failure_mode=failure_mode,
+            )
+        elif filter_type in ("polynomial", False):
+            # from paper:
+            # "The constant and linear trends of the columns in the matrix M were
+            # removed [prior to ...]"
+            voxel_timecourses, basis = nac.regress_poly(
+                degree, voxel_timecourses, failure_mode=failure_mode
+            )
+
+        # "Voxel time series from the noise ROI (either anatomical or tSTD) were
+        # placed in a matrix M of size Nxm, with time along the row dimension
+        # and voxels along the column dimension."
+        M = voxel_timecourses.T
+
+        # "[... were removed] prior to column-wise variance normalization."
+        stdM = np.std(M, axis=0)
+        stdM[(stdM == 0) | np.isnan(stdM)] = 1.0
+        M = M / stdM
+
+        # "The covariance matrix C = MMT was constructed and decomposed into its
+        # principal components using a singular value decomposition."
+        try:
+            u, s, _ = svd(M, full_matrices=False)
+        except (np.linalg.LinAlgError, ValueError):
+            if failure_mode == "error":
+                raise
+            s = np.full(M.shape[0], np.nan, dtype=np.float32)
+            if components_criterion >= 1:
+                u = np.full(
+                    (M.shape[0], components_criterion), np.nan, dtype=np.float32
+                )
+            else:
+                u = np.full((M.shape[0], 1), np.nan, dtype=np.float32)
+
+        variance_explained = (s ** 2) / np.sum(s ** 2)
+        cumulative_variance_explained = np.cumsum(variance_explained)
+
+        num_components = int(components_criterion)
+        if 0 < components_criterion < 1:
+            num_components = (
+                np.searchsorted(cumulative_variance_explained, components_criterion) + 1
+            )
+        elif components_criterion == -1:
+            num_components = len(s)
+
+        num_components = int(num_components)
+        if num_components == 0:
+            break
+
+        components.append(u[:, :num_components])
+        md_mask.append([name] * len(s))
+        md_sv.append(s)
+        md_var.append(variance_explained)
+        md_cumvar.append(cumulative_variance_explained)
+        md_retained.append([i < num_components for i in range(len(s))])
+
+    if len(components) > 0:
+        components = np.hstack(components)
+    else:
+        if failure_mode == "error":
+            raise ValueError("No components found")
+        components = np.full((M.shape[0], num_components), np.nan, dtype=np.float32)
+
+    metadata = OrderedDict(
+        [
+            ("mask", list(chain(*md_mask))),
+            ("singular_value", np.hstack(md_sv)),
+            ("variance_explained", np.hstack(md_var)),
+            ("cumulative_variance_explained", np.hstack(md_cumvar)),
+            ("retained", list(chain(*md_retained))),
+        ]
+    )
+
+    return components, basis, metadata
+
 
 class RobustACompCor(nac.ACompCor):
     """
@@ -27,7 +376,7 @@ class RobustACompCor(nac.ACompCor):
         failures = 0
         while True:
             try:
-                runtime = super(RobustACompCor, self)._run_interface(runtime)
+                runtime = _run_compcor(self, runtime)
                 break
             except LinAlgError:
                 failures += 1
@@ -50,7 +399,7 @@ class RobustTCompCor(nac.TCompCor):
         failures = 0
         while True:
             try:
-                runtime = super(RobustTCompCor, self)._run_interface(runtime)
+                runtime = _run_compcor(self, runtime)
                 break
             except LinAlgError:
                 failures += 1
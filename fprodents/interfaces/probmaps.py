@@ -0,0 +1,155 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""Handling of tissue probability maps (TPMs)."""
+import numpy as np
+import nibabel as nb
+from scipy import ndimage as nd
+from nipype.interfaces.base import File, isdefined
+from nipype.utils.filemanip import fname_presuffix
+from niworkflows.interfaces.probmaps import (
+    TPM2ROI as _TPM2ROI,
+    _TPM2ROIInputSpec,
+)
+
+
+class TPM2ROIInputSpec(_TPM2ROIInputSpec):
+    in_eroded_mask = File(
+        exists=True,
+        desc="eroded mask already calculated from ``in_mask`` "
+        "(``mask_erode_mm`` and ``mask_erode_prop`` are then ignored)",
+    )
+
+
+class TPM2ROI(_TPM2ROI):
+    """
+    Convert tissue probability maps (TPMs) into ROIs.
+
+    Extends niworkflows' interface so that the eroded brain mask calculated
+    by one node can be reused by other nodes sharing the same ``in_mask``.
+    Erosions are calculated in one pass from a distance transform, instead of
+    iterating :func:`scipy.ndimage.binary_erosion`.
+
+    """
+
+    input_spec = TPM2ROIInputSpec
+
+    def _run_interface(self, runtime):
+        inputs = {
+            name: getattr(self.inputs, name)
+            for name in (
+                "mask_erode_mm",
+                "erode_mm",
+                "mask_erode_prop",
+                "erode_prop",
+                "in_eroded_mask",
+            )
+        }
+        inputs = {k: v if isdefined(v) else None for k, v in inputs.items()}
+        roi_file, eroded_mask = _tpm2roi(
+            self.inputs.in_tpm,
+            self.inputs.in_mask,
+            inputs["mask_erode_mm"],
+            inputs["erode_mm"],
+            inputs["mask_erode_prop"],
+            inputs["erode_prop"],
+            self.inputs.prob_thresh,
+            eroded_mask=inputs["in_eroded_mask"],
+            newpath=runtime.cwd,
+        )
+        self._results["roi_file"] = roi_file
+        self._results["eroded_mask"] = eroded_mask
+        return runtime
+
+
+def _erode(mask, iterations=None, prop=None):
+    """
+    Erode a binary mask, as iterating :func:`scipy.ndimage.binary_erosion`.
+
+    Erosion by the default (cross) structuring element ``k`` times keeps
+    the voxels farther than ``k`` (city-block distance) from the background,
+    including the outside of the image.
+    Therefore, a single distance transform resolves any number of iterations.
+    With ``prop``, erosion proceeds until the ratio of remaining voxels falls
+    to ``prop`` or below.
+
+    >>> mask = np.zeros((9, 9, 9), dtype=bool)
+    >>> mask[1:8, 1:8, 2:] = True
+    >>> all(
+    ...     np.array_equal(_erode(mask, iterations=k),
+    ...                    nd.binary_erosion(mask, iterations=k))
+    ...     for k in range(1, 5)
+    ... )
+    True
+    >>> eroded = nd.binary_erosion(mask, iterations=2)
+    >>> np.array_equal(_erode(mask, prop=eroded.sum() / mask.sum()), eroded)
+    True
+
+    """
+    mask = np.asanyarray(mask) > 0
+    if iterations is not None and iterations < 1:
+        # binary_erosion with iterations < 1 erodes until nothing changes
+        return np.zeros_like(mask)
+
+    dist = nd.distance_transform_cdt(np.pad(mask, 1), metric="taxicab")
+    dist = dist[(slice(1, -1),) * mask.ndim]
+
+    if iterations is None:
+        orig_vol = np.count_nonzero(mask)
+        if not orig_vol:
+            return mask
+        # Number of voxels remaining after k = 0, 1, ... erosions
+        remaining = orig_vol - np.cumsum(np.bincount(dist[mask]))
+        iterations = int(np.argmax(remaining / orig_vol <= prop))
+    return dist > iterations
+
+
+def _tpm2roi(
+    in_tpm,
+    in_mask,
+    mask_erosion_mm=None,
+    erosion_mm=None,
+    mask_erosion_prop=None,
+    erosion_prop=None,
+    pthres=0.95,
+    eroded_mask=None,
+    newpath=None,
+):
+    """Generate a mask from a tissue probability map."""
+    tpm_img = nb.load(in_tpm)
+    roi_mask = (tpm_img.get_fdata() >= pthres).astype(np.uint8)
+
+    erode_in = (mask_erosion_mm is not None and mask_erosion_mm > 0) or (
+        mask_erosion_prop is not None and mask_erosion_prop < 1
+    )
+    if eroded_mask is not None:
+        roi_mask[np.asanyarray(nb.load(eroded_mask).dataobj) == 0] = 0
+    elif erode_in:
+        eroded_mask = fname_presuffix(in_mask, suffix="_eroded", newpath=newpath)
+        mask_img = nb.load(in_mask)
+        mask_data = np.asanyarray(mask_img.dataobj)
+        if mask_erosion_mm:
+            iter_n = max(int(mask_erosion_mm / max(mask_img.header.get_zooms())), 1)
+            mask_data = _erode(mask_data, iterations=iter_n)
+        else:
+            mask_data = _erode(mask_data, prop=mask_erosion_prop)
+
+        # Store mask
+        eroded = nb.Nifti1Image(mask_data, mask_img.affine, mask_img.header)
+        eroded.set_data_dtype(np.uint8)
+        eroded.to_filename(eroded_mask)
+
+        # Mask TPM data (no effect if not eroded)
+        roi_mask[~mask_data] = 0
+
+    # shrinking
+    if erosion_mm is not None and erosion_mm > 0:
+        iter_n = int(erosion_mm / max(tpm_img.header.get_zooms()))
+        roi_mask = _erode(roi_mask, iterations=iter_n)
+    elif erosion_prop is not None and erosion_prop < 1:
+        roi_mask = _erode(roi_mask, prop=erosion_prop)
+
+    roi_fname = fname_presuffix(in_tpm, suffix="_roi", newpath=newpath)
+    roi_img = nb.Nifti1Image(roi_mask, tpm_img.affine, tpm_img.header)
+    roi_img.set_data_dtype(np.uint8)
+    roi_img.to_filename(roi_fname)
+    return roi_fname, eroded_mask or in_mask
@@ -0,0 +1,86 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""Signal extraction interfaces."""
+import os
+
+import numpy as np
+import nibabel as nb
+from niworkflows.interfaces.images import SignalExtraction as _SignalExtraction
+
+
+class SignalExtraction(_SignalExtraction):
+    """
+    Extract mean signals from a time series within a set of ROIs.
+
+    Same as niworkflows' interface, but the time series is never loaded
+    whole: blocks of volumes are read (and scaled) one at a time, and all
+    the ROI means are calculated at once as a weighted sum of voxels (one
+    matrix product per block of volumes).
+
+    """
+
+    _block_size = 32  # volumes read and cast to float64 at a time
+
+    def _run_interface(self, runtime):
+        img = nb.load(self.inputs.in_file, keep_file_open=True)
+        mask_imgs = [nb.load(fname) for fname in self.inputs.label_files]
+        if len(mask_imgs) == 1 and len(mask_imgs[0].shape) == 4:
+            mask_imgs = nb.four_to_three(mask_imgs[0])
+        # This check assumes all input masks have same dimensions
+        if img.shape[:3] != mask_imgs[0].shape[:3]:
+            raise NotImplementedError(
+                "Input image and mask should be of same dimensions before "
+                "running SignalExtraction"
+            )
+        # If mask is a list, each mask is treated as its own ROI/parcel
+        # If mask is a 3D, each integer is treated as its own ROI/parcel
+        if len(mask_imgs) > 1:
+            masks = [
+                np.asanyarray(mask_img.dataobj) >= self.inputs.prob_thres
+                for mask_img in mask_imgs
+            ]
+        else:
+            labelsmap = np.asanyarray(mask_imgs[0].dataobj)
+            labels = np.unique(labelsmap)
+            labels = labels[labels != 0]
+            masks = [labelsmap == label for label in labels]
+
+        if len(masks) != len(self.inputs.class_labels):
+            raise ValueError("Number of masks must match number of labels")
+
+        # Voxels x ROIs matrix of weights, restricted to the union of ROIs
+        weights = np.stack([mask.reshape(-1, order="F") for mask in masks], axis=1)
+        in_rois = weights.any(axis=1)
+        weights = weights[in_rois].astype(float)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            weights /= weights.sum(axis=0)  # empty ROIs give NaN, as np.mean
+
+        dataobj = img.dataobj
+        nvols = img.shape[-1]
+        if nb.is_proxy(dataobj) and not self.inputs.in_file.endswith(".gz"):
+            # Memory-mapped in the on-disk data type: only the voxels within
+            # ROIs are read, and scaling (if any) is applied block by block
+            data = dataobj.get_unscaled().reshape((-1, nvols), order="F")
+            slope, inter = dataobj.slope, dataobj.inter
+
+            def _get_block(block):
+                return data[in_rois, block] * slope + inter
+
+        else:
+            # Compressed series are decompressed one block of volumes at a time
+
+            def _get_block(block):
+                data = np.asarray(dataobj[..., block], dtype=float)
+                return data.reshape((-1, data.shape[-1]), order="F")[in_rois]
+
+        series = np.zeros((nvols, len(masks)))
+        for start in range(0, nvols, self._block_size):
+            block = slice(start, start + self._block_size)
+            series[block] = _get_block(block).T @ weights
+
+        output = np.vstack((self.inputs.class_labels, series.astype(str)))
+        self._results["out_file"] = os.path.join(runtime.cwd, self.inputs.out_file)
+        np.savetxt(self._results["out_file"], output, fmt="%s", delimiter="\t")
+
+        return runtime
+
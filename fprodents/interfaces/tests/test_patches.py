@@ -0,0 +1,60 @@
+""" Testing module for fprodents.interfaces.patches """
+import numpy as np
+import nibabel as nb
+import pandas as pd
+import pytest
+from nipype.algorithms import confounds as nac
+
+from ..patches import RobustACompCor, RobustTCompCor, _compcor_svd
+
+
+def _match_up_to_sign(a, b):
+    signs = np.sign(np.sum(a * b, axis=0))
+    return np.allclose(a * signs, b, atol=1e-4)
+
+
+def test_compcor_svd():
+    rng = np.random.default_rng(0)
+    # Wide and badly conditioned, like a CompCor (time x voxels) matrix
+    a = rng.standard_normal((30, 5000)) * np.logspace(0, -6, 30)[:, np.newaxis]
+    u, s, _ = _compcor_svd(a, full_matrices=False)
+    ref_u, ref_s, _ = np.linalg.svd(a, full_matrices=False)
+    assert np.allclose(s, ref_s, rtol=1e-8)
+    assert _match_up_to_sign(u, ref_u)
+
+
+@pytest.mark.parametrize(
+    "interface,nipype_interface",
+    [(RobustACompCor, nac.ACompCor), (RobustTCompCor, nac.TCompCor)],
+)
+def test_compcor_components(tmp_path, interface, nipype_interface):
+    rng = np.random.default_rng(1234)
+    data = rng.standard_normal((10, 10, 10, 40)) + 100
+    nb.Nifti1Image(data.astype("float32"), np.eye(4)).to_filename(tmp_path / "bold.nii")
+    mask = np.zeros((10, 10, 10), dtype="uint8")
+    mask[2:8, 2:8, 2:8] = 1
+    nb.Nifti1Image(mask, np.eye(4)).to_filename(tmp_path / "mask.nii")
+
+    outputs = []
+    for iface, cwd in ((interface, "ours"), (nipype_interface, "nipype")):
+        (tmp_path / cwd).mkdir()
+        outputs.append(
+            iface(
+                realigned_file=str(tmp_path / "bold.nii"),
+                mask_files=[str(tmp_path / "mask.nii")],
+                variance_threshold=0.5,
+                pre_filter="cosine",
+                repetition_time=2.0,
+                ignore_initial_volumes=2,
+                save_pre_filter=True,
+                save_metadata=True,
+            ).run(cwd=str(tmp_path / cwd)).outputs
+        )
+
+    ours, theirs = (pd.read_csv(out.components_file, sep="\t") for out in outputs)
+    assert list(ours.columns) == list(theirs.columns)
+    assert len(ours) == 40
+    assert _match_up_to_sign(ours.values, theirs.values)
+    for name in ("pre_filter_file", "metadata_file"):
+        ours, theirs = (pd.read_csv(getattr(out, name), sep="\t") for out in outputs)
+        pd.testing.assert_frame_equal(ours, theirs, atol=1e-6)
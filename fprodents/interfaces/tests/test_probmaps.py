@@ -0,0 +1,96 @@
+""" Testing module for fprodents.interfaces.probmaps """
+import numpy as np
+import nibabel as nb
+import pytest
+from scipy import ndimage as ndi
+from niworkflows.interfaces.probmaps import TPM2ROI as NiworkflowsTPM2ROI
+
+from ..probmaps import TPM2ROI
+
+AFFINE = np.diag([0.5, 0.5, 0.5, 1.0])
+
+
+@pytest.fixture
+def tissues(tmp_path):
+    """An ellipsoidal brain mask and two smooth tissue probability maps."""
+    shape = (32, 28, 24)
+    grid = np.indices(shape) - np.array(shape)[:, np.newaxis, np.newaxis, np.newaxis] / 2
+    radius = np.sqrt((grid[0] / 13) ** 2 + (grid[1] / 11) ** 2 + (grid[2] / 9) ** 2)
+    mask = (radius <= 1).astype("uint8")
+    nb.Nifti1Image(mask, AFFINE).to_filename(tmp_path / "mask.nii.gz")
+
+    # Probabilities decrease from a noisy core outwards
+    rng = np.random.default_rng(1234)
+    tpms = []
+    for name in ("wm", "csf"):
+        noise = ndi.gaussian_filter(rng.standard_normal(size=shape), 2)
+        tpm = mask / (1 + np.exp(20 * (radius - 0.6) + 5 * noise / noise.std()))
+        fname = tmp_path / f"{name}.nii.gz"
+        nb.Nifti1Image(tpm.astype("float32"), AFFINE).to_filename(fname)
+        tpms.append(str(fname))
+    return {"in_mask": str(tmp_path / "mask.nii.gz"), "tpms": tpms}
+
+
+def _run(interface, tmp_path, name, **inputs):
+    (tmp_path / name).mkdir()
+    return interface(**inputs).run(cwd=str(tmp_path / name)).outputs
+
+
+def _data(fname):
+    return np.asanyarray(nb.load(fname).dataobj)
+
+
+@pytest.mark.parametrize(
+    "params",
+    [
+        {"erode_mm": 0, "mask_erode_mm": 1},
+        {"erode_mm": 1, "mask_erode_mm": 1.5},
+        {"erode_prop": 0.6, "mask_erode_prop": 0.6 ** 3},
+        {"erode_prop": 0.6},
+        {"prob_thresh": 0.5},
+    ],
+)
+def test_tpm2roi(tissues, tmp_path, params):
+    inputs = {"in_tpm": tissues["tpms"][0], "in_mask": tissues["in_mask"], **params}
+    ours = _run(TPM2ROI, tmp_path, "ours", **inputs)
+    theirs = _run(NiworkflowsTPM2ROI, tmp_path, "niworkflows", **inputs)
+
+    assert _data(ours.roi_file).any()
+    assert np.array_equal(_data(ours.roi_file), _data(theirs.roi_file))
+    assert np.array_equal(_data(ours.eroded_mask), _data(theirs.eroded_mask))
+
+
+def test_tpm2roi_eroded_mask(tissues, tmp_path):
+    params = {"erode_prop": 0.6, "mask_erode_prop": 0.6 ** 3}
+    first = _run(
+        TPM2ROI,
+        tmp_path,
+        "first",
+        in_tpm=tissues["tpms"][0],
+        in_mask=tissues["in_mask"],
+        **params,
+    )
+    assert first.eroded_mask != tissues["in_mask"]
+
+    # The second ROI reuses the eroded mask instead of calculating it again
+    reused = _run(
+        TPM2ROI,
+        tmp_path,
+        "reused",
+        in_tpm=tissues["tpms"][1],
+        in_mask=tissues["in_mask"],
+        in_eroded_mask=first.eroded_mask,
+        **params,
+    )
+    assert reused.eroded_mask == first.eroded_mask
+    assert not (tmp_path / "reused" / "mask_eroded.nii.gz").exists()
+
+    expected = _run(
+        NiworkflowsTPM2ROI,
+        tmp_path,
+        "expected",
+        in_tpm=tissues["tpms"][1],
+        in_mask=tissues["in_mask"],
+        **params,
+    )
+    assert np.array_equal(_data(reused.roi_file), _data(expected.roi_file))
@@ -0,0 +1,237 @@
+""" Testing module for fprodents.interfaces.resampling """
+import shutil
+import subprocess
+
+import pytest
+import numpy as np
+import nibabel as nb
+import nitransforms as nt
+from scipy import ndimage as ndi
+
+from ..resampling import ResampleSeries
+
+NVOLS = 4
+SRC_AFFINE = np.array(
+    [[0.3, 0.0, 0.0, -3.0], [0.0, 0.3, 0.0, -3.3], [0.0, 0.0, 0.6, -4.5], [0, 0, 0, 1]]
+)
+REF_AFFINE = np.array(
+    [[0.25, 0.0, 0.0, -2.5], [0.0, 0.25, 0.0, -2.8], [0.0, 0.0, 0.25, -3.5], [0, 0, 0, 1]]
+)
+REF_SHAPE = (20, 22, 28)
+
+
+def _write_itk_affines(fname, matrices):
+    lines = ["#Insight Transform File V1.0"]
+    for i, matrix in enumerate(matrices):
+        params = list(matrix[:3, :3].ravel()) + list(matrix[:3, 3])
+        lines += [
+            f"#Transform {i}",
+            "Transform: AffineTransform_double_3_3",
+            "Parameters: " + " ".join("%.10f" % p for p in params),
+            "FixedParameters: 0 0 0",
+        ]
+    fname.write_text("\n".join(lines) + "\n")
+    return str(fname)
+
+
+@pytest.fixture
+def series(tmp_path):
+    """A smooth synthetic series with its head-motion and coregistration affines."""
+    rng = np.random.default_rng(1234)
+    data = ndi.gaussian_filter(rng.uniform(size=(24, 24, 16, NVOLS)), (2, 2, 1, 0))
+    data = (data - data.min()) / np.ptp(data) * 1000
+    nb.Nifti1Image(data.astype("float32"), SRC_AFFINE).to_filename(
+        tmp_path / "bold.nii"
+    )
+
+    hmc = [np.eye(4)]  # The reference volume does not move
+    for _ in range(NVOLS - 1):
+        matrix = np.eye(4)
+        matrix[:3, :3] += rng.normal(scale=0.02, size=(3, 3))
+        matrix[:3, 3] = rng.normal(scale=0.2, size=3)
+        hmc.append(matrix)
+
+    bold2anat = np.eye(4)
+    bold2anat[:3, :3] += rng.normal(scale=0.03, size=(3, 3))
+    bold2anat[:3, 3] = [0.4, -0.2, 0.3]
+
+    nb.Nifti1Image(np.zeros(REF_SHAPE, dtype="float32"), REF_AFFINE).to_filename(
+        tmp_path / "ref.nii"
+    )
+    return {
+        "in_file": str(tmp_path / "bold.nii"),
+        "ref_file": str(tmp_path / "ref.nii"),
+        "data": data.astype("float32"),
+        "hmc": _write_itk_affines(tmp_path / "hmc.txt", hmc),
+        "bold2anat": _write_itk_affines(tmp_path / "bold2anat.txt", [bold2anat]),
+        "tmp_path": tmp_path,
+    }
+
+
+def _expected(series, transforms, order=3):
+    """Pull every output voxel through the chain, one transform at a time."""
+    ijk = np.indices(REF_SHAPE).reshape(3, -1).T
+    volumes = []
+    for i in range(NVOLS):
+        points = nb.affines.apply_affine(REF_AFFINE, ijk)
+        for fname in transforms:
+            # ITK files are LPS: NiTransforms reads the matrices back in RAS
+            matrix = nt.linear.load(fname, fmt="itk").matrix
+            if matrix.ndim == 3:  # head-motion, one affine per volume
+                matrix = matrix[i]
+            points = nb.affines.apply_affine(matrix, points)
+        coords = nb.affines.apply_affine(np.linalg.inv(SRC_AFFINE), points).T
+        volumes.append(
+            ndi.map_coordinates(series["data"][..., i], coords, order=order).reshape(
+                REF_SHAPE
+            )
+        )
+    return np.stack(volumes, axis=-1)
+
+
+def _zero_warp(series):
+    """An ITK displacement field of zeros, which forces the nonlinear code path."""
+    field = np.zeros(REF_SHAPE + (1, 3), dtype="float32")
+    img = nb.Nifti1Image(field, REF_AFFINE)
+    img.header.set_intent("vector")
+    fname = str(series["tmp_path"] / "warp.nii.gz")
+    img.to_filename(fname)
+    return fname
+
+
+def _run(series, tmp_path, **inputs):
+    inputs.setdefault("in_file", series["in_file"])
+    inputs.setdefault("ref_file", series["ref_file"])
+    result = ResampleSeries(**inputs).run(cwd=str(tmp_path))
+    return result.outputs.out_file
+
+
+def test_chain_and_hmc(series, tmp_path):
+    transforms = [series["bold2anat"], series["hmc"]]
+    out = nb.load(_run(series, tmp_path, transforms=transforms))
+    assert out.shape == REF_SHAPE + (NVOLS,)
+    assert np.allclose(out.affine, REF_AFFINE)
+    expected = _expected(series, transforms)
+    assert np.allclose(out.get_fdata(), expected, atol=1e-3)
+
+    # Volumes moved differently, and the order of the chain matters
+    swapped = _expected(series, transforms[::-1])
+    assert np.abs(out.get_fdata() - swapped).max() > 1
+    assert np.abs(out.dataobj[..., 1] - expected[..., 0]).max() > 1
+
+
+def test_linear_and_nonlinear_paths(series, tmp_path):
+    transforms = [series["bold2anat"], series["hmc"]]
+    linear = nb.load(_run(series, tmp_path, transforms=transforms)).get_fdata()
+
+    (tmp_path / "warp").mkdir()
+    warped = _run(
+        series, tmp_path / "warp", transforms=[_zero_warp(series)] + transforms
+    )
+    assert np.allclose(nb.load(warped).get_fdata(), linear, atol=1e-3)
+
+
+def test_identity(series, tmp_path):
+    out = _run(
+        series,
+        tmp_path,
+        ref_file=series["in_file"],
+        transforms=["identity"],
+        compress=False,
+    )
+    assert out.endswith("_resampled.nii")
+    assert np.array_equal(np.asanyarray(nb.load(out).dataobj), series["data"])
+
+    # The HMC reference volume is copied unchanged
+    out = _run(series, tmp_path, ref_file=series["in_file"], transforms=[series["hmc"]])
+    assert np.array_equal(nb.load(out).dataobj[..., 0], series["data"][..., 0])
+
+
+@pytest.mark.parametrize("ext", [".nii", ".nii.gz"])
+def test_scaled_input(series, tmp_path, ext):
+    img = nb.Nifti1Image(series["data"], SRC_AFFINE)
+    img.set_data_dtype("int16")
+    in_file = str(tmp_path / f"bold_int16{ext}")
+    img.to_filename(in_file)
+    img = nb.load(in_file)
+    assert img.dataobj.slope != 1.0
+
+    out = _run(
+        series, tmp_path, in_file=in_file, ref_file=in_file, transforms=["identity"]
+    )
+    assert np.allclose(nb.load(out).get_fdata(), img.get_fdata(), atol=1e-3)
+
+
+def test_compression(series, tmp_path):
+    header_source = str(tmp_path / "bold_tr.nii")
+    img = nb.load(series["in_file"])
+    img.header.set_zooms(img.header.get_zooms()[:3] + (1.5,))
+    img.header.set_xyzt_units("mm", "sec")
+    img.to_filename(header_source)
+
+    outputs = []
+    for compress in (True, False):
+        (tmp_path / str(compress)).mkdir()
+        outputs.append(
+            _run(
+                series,
+                tmp_path / str(compress),
+                transforms=[series["bold2anat"], series["hmc"]],
+                header_source=header_source,
+                compress=compress,
+            )
+        )
+
+    assert outputs[0].endswith("_resampled.nii.gz")
+    assert outputs[1].endswith("_resampled.nii")
+    with open(outputs[0], "rb") as fobj:
+        assert fobj.read(2) == b"\x1f\x8b"
+    gz_img, nii_img = nb.load(outputs[0]), nb.load(outputs[1])
+    assert np.array_equal(gz_img.get_fdata(), nii_img.get_fdata())
+    assert gz_img.header.get_zooms()[3] == pytest.approx(1.5)
+    assert gz_img.header.get_xyzt_units() == ("mm", "sec")
+
+
+@pytest.mark.skipif(
+    not shutil.which("antsApplyTransforms"), reason="ANTs is not installed"
+)
+def test_ants(series, tmp_path):
+    out = nb.load(_run(series, tmp_path, transforms=[series["bold2anat"]]))
+
+    vol = str(tmp_path / "vol0.nii.gz")
+    nb.Nifti1Image(series["data"][..., 0], SRC_AFFINE).to_filename(vol)
+    ants_out = str(tmp_path / "ants.nii.gz")
+    subprocess.run(
+        [
+            "antsApplyTransforms", "-d", "3", "-n", "BSpline[3]", "-i", vol,
+            "-r", series["ref_file"], "-t", series["bold2anat"], "-o", ants_out,
+        ],
+        check=True,
+    )
+    expected = nb.load(ants_out).get_fdata()
+    # Compare away from the borders, where boundary conditions differ
+    inner = ndi.binary_erosion(expected != 0, iterations=3)
+    assert np.allclose(out.dataobj[..., 0][inner], expected[inner], atol=1.0)
+
+
+def test_keep_file_open(series, tmp_path, monkeypatch):
+    loaded = {}
+    load = nb.load
+
+    def _load(fname, **kwargs):
+        loaded[fname] = kwargs.get("keep_file_open")
+        return load(fname, **kwargs)
+
+    in_file = str(tmp_path / "bold.nii.gz")
+    nb.Nifti1Image(series["data"], SRC_AFFINE).to_filename(in_file)
+    monkeypatch.setattr(nb, "load", _load)
+    _run(series, tmp_path, in_file=in_file, transforms=[series["hmc"]])
+    # The 4D series is kept open (seekable), but not every 3D volume of a list
+    assert loaded[in_file] is True
+
+    vols = [str(tmp_path / f"vol{i}.nii.gz") for i in range(NVOLS)]
+    for i, vol in enumerate(vols):
+        nb.Nifti1Image(series["data"][..., i], SRC_AFFINE).to_filename(vol)
+    (tmp_path / "vols").mkdir()
+    _run(series, tmp_path / "vols", in_file=vols, transforms=[series["hmc"]])
+    assert not any(loaded[vol] for vol in vols)
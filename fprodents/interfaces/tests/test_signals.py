@@ -0,0 +1,64 @@
+""" Testing module for fprodents.interfaces.signals """
+import numpy as np
+import nibabel as nb
+import pytest
+from niworkflows.interfaces.images import SignalExtraction as NiwSignalExtraction
+
+from ..signals import SignalExtraction
+
+SHAPE = (12, 10, 8)
+NVOLS = 70  # not a multiple of the block size
+
+
+@pytest.fixture
+def inputs(tmp_path):
+    rng = np.random.default_rng(1234)
+    data = rng.uniform(0, 1000, size=SHAPE + (NVOLS,))
+    labels = rng.integers(0, 4, size=SHAPE).astype("uint8")
+    labels[labels == 3] = 0  # labels need not be contiguous
+    labels[0, 0, 0] = 5
+
+    nb.Nifti1Image(labels, np.eye(4)).to_filename(tmp_path / "labels.nii.gz")
+    masks = []
+    for i, label in enumerate((1, 2, 5)):
+        masks.append(str(tmp_path / f"mask{i}.nii.gz"))
+        mask = nb.Nifti1Image((labels == label).astype("float32"), np.eye(4))
+        mask.to_filename(masks[-1])
+    return {
+        "data": data,
+        "labels": str(tmp_path / "labels.nii.gz"),
+        "masks": masks,
+        "tmp_path": tmp_path,
+    }
+
+
+@pytest.mark.parametrize("dtype", ["float32", "int16"])
+@pytest.mark.parametrize("ext", [".nii", ".nii.gz"])
+@pytest.mark.parametrize("rois", ["labels", "masks"])
+def test_signal_extraction(inputs, dtype, ext, rois):
+    tmp_path = inputs["tmp_path"]
+    img = nb.Nifti1Image(inputs["data"], np.eye(4))
+    img.set_data_dtype(dtype)
+    in_file = str(tmp_path / f"bold{ext}")
+    img.to_filename(in_file)
+    if dtype == "int16":
+        assert nb.load(in_file).dataobj.slope != 1.0
+
+    label_files = inputs[rois]
+    if rois == "labels":
+        label_files = [label_files]
+
+    outputs = []
+    for iface, cwd in ((SignalExtraction, "ours"), (NiwSignalExtraction, "niw")):
+        (tmp_path / cwd).mkdir()
+        outputs.append(
+            iface(
+                in_file=in_file,
+                label_files=label_files,
+                class_labels=["a", "b", "c"],
+            ).run(cwd=str(tmp_path / cwd)).outputs.out_file
+        )
+
+    ours, theirs = (np.loadtxt(out, skiprows=1) for out in outputs)
+    assert ours.shape == (NVOLS, 3)
+    assert np.allclose(ours, theirs)
@@ -1,3 +1,6 @@
+from functools import lru_cache
+
+
 def fix_multi_source_name(in_files, modality="T2w"):
     """
     Make up a generic source name when there are multiple
@@ -80,14 +83,13 @@ def extract_entities(file_list):
 
     """
     from collections import defaultdict
-    from bids.layout import parse_file_entities
     from niworkflows.utils.connections import listify
 
     entities = defaultdict(list)
     for e, v in [
         ev_pair
         for f in listify(file_list)
-        for ev_pair in parse_file_entities(f).items()
+        for ev_pair in _parse_file_entities(str(f))
     ]:
         entities[e].append(v)
 
@@ -98,3 +100,11 @@ def extract_entities(file_list):
         return inlist
 
     return {k: _unique(v) for k, v in entities.items()}
+
+
+@lru_cache(maxsize=4096)
+def _parse_file_entities(filename):
+    """Parse (and memoize) the BIDS entities of a file name."""
+    from bids.layout import parse_file_entities
+
+    return tuple(parse_file_entities(filename).items())
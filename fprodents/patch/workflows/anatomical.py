@@ -1250,20 +1250,21 @@ def _fmt_cohort(template, cohort=None):
 
 def _rpt_masks(mask_file, before, after, after_mask=None):
     from os.path import abspath
+    import numpy as np
     import nibabel as nb
 
-    msk = nb.load(mask_file).get_fdata() > 0
+    msk = np.asanyarray(nb.load(mask_file).dataobj) > 0
     bnii = nb.load(before)
-    nb.Nifti1Image(bnii.get_fdata() * msk, bnii.affine, bnii.header).to_filename(
-        "before.nii.gz"
-    )
+    nb.Nifti1Image(
+        np.asanyarray(bnii.dataobj) * msk, bnii.affine, bnii.header
+    ).to_filename("before.nii.gz")
     if after_mask is not None:
-        msk = nb.load(after_mask).get_fdata() > 0
+        msk = np.asanyarray(nb.load(after_mask).dataobj) > 0
 
     anii = nb.load(after)
-    nb.Nifti1Image(anii.get_fdata() * msk, anii.affine, anii.header).to_filename(
-        "after.nii.gz"
-    )
+    nb.Nifti1Image(
+        np.asanyarray(anii.dataobj) * msk, anii.affine, anii.header
+    ).to_filename("after.nii.gz")
     return abspath("before.nii.gz"), abspath("after.nii.gz")
 
 
@@ -45,3 +45,4 @@ def test_config_spaces():
         for s in spaces.references
         if s.standard and s.dim == 3
     ] == ["Fischer344"]
+
@@ -17,7 +17,7 @@ from nipype.interfaces import utility as niu
 
 from .. import config
 from ..interfaces import SubjectSummary, AboutSummary, DerivativesDataSink
-from .bold.base import init_func_preproc_wf
+from .bold.base import index_sbrefs, init_func_preproc_wf
 
 
 def init_fmriprep_wf():
@@ -299,6 +299,7 @@ tasks and sessions), the following preprocessing was performed.
         )
     )
 
+    sbref_index = index_sbrefs(config.execution.layout, subject_id)
     for bold_file in subject_data["bold"]:
         echoes = extract_entities(bold_file).get("echo", [])
         echo_idxs = listify(echoes)
@@ -324,7 +325,7 @@ tasks and sessions), the following preprocessing was performed.
         bold_ref_wf.inputs.n4_avgs.shrink_factor = 1
         bold_ref_wf.inputs.n4_avgs.n_iterations = [50] * 4
 
-        func_preproc_wf = init_func_preproc_wf(bold_file)
+        func_preproc_wf = init_func_preproc_wf(bold_file, sbref_index=sbref_index)
 
         # fmt:off
         workflow.connect([
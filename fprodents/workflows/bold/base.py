@@ -11,33 +11,27 @@ Orchestrating the BOLD-preprocessing workflow
 from ... import config
 
 import os
+from functools import lru_cache
 
-import nibabel as nb
-from nipype.interfaces.fsl import Split as FSLSplit
 from nipype.pipeline import engine as pe
 from nipype.interfaces import utility as niu
 
 from niworkflows.utils.connections import pop_file, listify
 
+from .outputs import init_func_derivatives_wf
 
-from ...utils.meepi import combine_meepi_source
-
-from ...interfaces import DerivativesDataSink
-from ...interfaces.reports import FunctionalSummary
+__all__ = [
+    "init_func_preproc_wf",
+    "init_func_derivatives_wf",
+    "index_sbrefs",
+]
 
-# BOLD workflows
-from .confounds import init_bold_confs_wf, init_carpetplot_wf
-from .stc import init_bold_stc_wf
-from .t2s import init_bold_t2s_wf
-from .registration import init_bold_t1_trans_wf, init_bold_reg_wf
-from .resampling import (
-    init_bold_std_trans_wf,
-    init_bold_preproc_trans_wf,
-)
-from .outputs import init_func_derivatives_wf
+_GB = 1 << 30  # bytes per GiB
+_SBREF_IGNORED_ENTITIES = ("suffix", "extension", "echo")
+_WF_NAME_TABLE = str.maketrans({".": "_", " ": "", "-": "_"})
 
 
-def init_func_preproc_wf(bold_file):
+def init_func_preproc_wf(bold_file, sbref_index=None):
     """
     This workflow controls the functional preprocessing stages of *fMRIPrep*.
 
@@ -54,6 +48,14 @@ def init_func_preproc_wf(bold_file):
                     / 'sub-01_task-mixedgamblestask_run-01_bold.nii.gz'
                 wf = init_func_preproc_wf(str(bold_file))
 
+    Parameters
+    ----------
+    bold_file : :obj:`str` or :obj:`list`
+        BOLD series NIfTI file (or list of echoes, for multi-echo data)
+    sbref_index : :obj:`dict` or ``None``
+        Single-band references of the participant, as returned by
+        :py:func:`index_sbrefs`. If ``None``, the BIDS layout is queried.
+
     Inputs
     ------
     bold_file
@@ -126,7 +128,20 @@ def init_func_preproc_wf(bold_file):
     from niworkflows.interfaces.utility import KeySelect, DictMerge
     from nipype.interfaces.freesurfer.utils import LTAConvert
 
+    from ...interfaces import DerivativesDataSink
+    from ...interfaces.reports import FunctionalSummary
     from ...patch.utils import extract_entities
+    from ...utils.meepi import combine_meepi_source
+
+    # BOLD workflows
+    from .confounds import init_bold_confs_wf, init_carpetplot_wf
+    from .stc import init_bold_stc_wf
+    from .t2s import init_bold_t2s_wf
+    from .registration import init_bold_t1_trans_wf, init_bold_reg_wf
+    from .resampling import (
+        init_bold_std_trans_wf,
+        init_bold_preproc_trans_wf,
+    )
 
     mem_gb = {"filesize": 1, "resampled": 1, "largemem": 1}
     bold_tlen = 10
@@ -134,6 +149,7 @@ def init_func_preproc_wf(bold_file):
     # Have some options handy
     omp_nthreads = config.nipype.omp_nthreads
     spaces = config.workflow.spaces
+    std_spaces_3d = spaces.get_spaces(nonstandard=False, dim=(3,))
     output_dir = str(config.execution.output_dir)
 
     # Extract BIDS entities and metadata from BOLD file(s)
@@ -142,7 +158,7 @@ def init_func_preproc_wf(bold_file):
 
     # Take first file as reference
     ref_file = pop_file(bold_file)
-    metadata = layout.get_metadata(ref_file)
+    metadata = _get_metadata(layout, os.fspath(ref_file))
 
     echo_idxs = listify(entities.get("echo", []))
     multiecho = len(echo_idxs) > 2
@@ -162,7 +178,10 @@ def init_func_preproc_wf(bold_file):
         entities.pop("echo", None)
         # reorder echoes from shortest to largest
         tes, bold_file = zip(
-            *sorted([(layout.get_metadata(bf)["EchoTime"], bf) for bf in bold_file])
+            *sorted(
+                (_get_metadata(layout, os.fspath(bf))["EchoTime"], bf)
+                for bf in bold_file
+            )
         )
         ref_file = bold_file[0]  # Reset reference to be the shortest TE
 
@@ -181,16 +200,20 @@ def init_func_preproc_wf(bold_file):
     )
 
     # Find associated sbref, if possible
-    entities["suffix"] = "sbref"
-    entities["extension"] = ["nii", "nii.gz"]  # Overwrite extensions
-    sbref_files = layout.get(return_type="file", **entities)
+    if sbref_index is None:
+        entities["suffix"] = "sbref"
+        entities["extension"] = ["nii", "nii.gz"]  # Overwrite extensions
+        sbref_files = layout.get(return_type="file", **entities)
+    else:
+        sbref_files = _lookup_sbrefs(sbref_index, entities)
 
-    sbref_msg = f"No single-band-reference found for {os.path.basename(ref_file)}."
-    if sbref_files and "sbref" in config.workflow.ignore:
+    if not sbref_files:
+        sbref_msg = f"No single-band-reference found for {os.path.basename(ref_file)}."
+    elif "sbref" in config.workflow.ignore:
         sbref_msg = "Single-band reference file(s) found and ignored."
-    elif sbref_files:
+    else:
         sbref_msg = "Using single-band reference file(s) {}.".format(
-            ",".join([os.path.basename(sbf) for sbf in sbref_files])
+            ",".join(os.path.basename(sbf) for sbf in sbref_files)
         )
     config.loggers.workflow.info(sbref_msg)
 
@@ -207,7 +230,9 @@ All resamplings can be performed with *a single interpolation
 step* by composing all the pertinent transformations (i.e. head-motion
 transform matrices, susceptibility distortion correction when available,
 and co-registrations to anatomical and output spaces).
-Gridded (volumetric) resamplings were performed using `antsApplyTransforms` (ANTs),
+Gridded (volumetric) resamplings of the BOLD time-series were performed
+in-process with *NiTransforms* and cubic B-spline interpolation.
+Other gridded resamplings were performed using `antsApplyTransforms` (ANTs),
 configured with Lanczos interpolation to minimize the smoothing
 effects of other kernels [@lanczos].
 Non-gridded (surface) resamplings were performed using `mri_vol2surf`
@@ -316,11 +341,6 @@ Non-gridded (surface) resamplings were performed using `mri_vol2surf`
     ])
     # fmt:on
 
-    # Top-level BOLD splitter
-    bold_split = pe.Node(
-        FSLSplit(dimension="t"), name="bold_split", mem_gb=mem_gb["filesize"] * 3
-    )
-
     # calculate BOLD registration to T1w
     bold_reg_wf = init_bold_reg_wf(
         bold2t1w_dof=config.workflow.bold2t1w_dof,
@@ -391,7 +411,7 @@ Non-gridded (surface) resamplings were performed using `mri_vol2surf`
             ])
             # fmt:on
     elif not multiecho:  # STC is too short or False
-        # bypass STC from original BOLD to the splitter through boldbuffer
+        # bypass STC from original BOLD to the resamplers through boldbuffer
         # fmt:off
         workflow.connect([
             (inputnode, boldbuffer, [('bold_file', 'bold_file')])
@@ -443,7 +463,6 @@ Non-gridded (surface) resamplings were performed using `mri_vol2surf`
         # convert bold reference LTA transform to other formats
         (inputnode, lta_convert, [('bold_ref_xfm', 'in_lta')]),
         # BOLD buffer has slice-time corrected if it was run, original otherwise
-        (boldbuffer, bold_split, [('bold_file', 'in_file')]),
         (inputnode, summary, [('n_dummy_scans', 'algo_dummy_scans')]),
         # EPI-T1 registration workflow
         (inputnode, bold_t1_trans_wf, [('bold_file', 'inputnode.name_source'),
@@ -461,23 +480,31 @@ Non-gridded (surface) resamplings were performed using `mri_vol2surf`
         (t1w_mask_bold_tfm, outputnode, [('output_image', 'bold_mask')]),
         # Connect bold_confounds_wf
         (inputnode, bold_confounds_wf, [('anat_tpms', 'inputnode.anat_tpms'),
-                                        ('anat_mask', 'inputnode.t1w_mask')]),
+                                        ('anat_mask', 'inputnode.t1w_mask'),
+                                        ('n_dummy_scans', 'inputnode.skip_vols')]),
         (lta_convert, bold_confounds_wf, [('out_fsl', 'inputnode.movpar_file')]),
         (bold_reg_wf, bold_confounds_wf, [('outputnode.anat2bold', 'inputnode.anat2bold')]),
-        (inputnode, bold_confounds_wf, [('n_dummy_scans', 'inputnode.skip_vols')]),
         (t1w_mask_bold_tfm, bold_confounds_wf, [('output_image', 'inputnode.bold_mask')]),
-        (bold_confounds_wf, outputnode, [('outputnode.confounds_file', 'confounds')]),
-        (bold_confounds_wf, outputnode, [('outputnode.confounds_metadata', 'confounds_metadata')]),
         # Connect bold_bold_trans_wf
         (inputnode, bold_bold_trans_wf, [('ref_file', 'inputnode.bold_ref')]),
         (t1w_mask_bold_tfm, bold_bold_trans_wf, [('output_image', 'inputnode.bold_mask')]),
-        (bold_split, bold_bold_trans_wf, [('out_files', 'inputnode.bold_file')]),
+        (boldbuffer, bold_bold_trans_wf, [('bold_file', 'inputnode.bold_file')]),
         (lta_convert, bold_bold_trans_wf, [('out_itk', 'inputnode.hmc_xforms')]),
         # Summary
         (outputnode, summary, [('confounds', 'confounds_file')]),
     ])
     # fmt:on
 
+    # ICA-AROMA (if run) takes over the confounds outputs below
+    if not (config.workflow.use_aroma and std_spaces_3d):
+        # fmt:off
+        workflow.connect([
+            (bold_confounds_wf, outputnode, [
+                ('outputnode.confounds_file', 'confounds'),
+                ('outputnode.confounds_metadata', 'confounds_metadata')]),
+        ])
+        # fmt:on
+
     # for standard EPI data, pass along correct file
     if not multiecho:
         # fmt:off
@@ -486,8 +513,8 @@ Non-gridded (surface) resamplings were performed using `mri_vol2surf`
                 ('bold_file', 'inputnode.source_file')]),
             (bold_bold_trans_wf, bold_confounds_wf, [
                 ('outputnode.bold', 'inputnode.bold')]),
-            (bold_split, bold_t1_trans_wf, [
-                ('out_files', 'inputnode.bold_split')]),
+            (boldbuffer, bold_t1_trans_wf, [
+                ('bold_file', 'inputnode.bold_split')]),
         ])
         # fmt:on
     else:  # for meepi, create and use optimal combination
@@ -506,8 +533,8 @@ Non-gridded (surface) resamplings were performed using `mri_vol2surf`
         # fmt:on
 
     # Map final BOLD mask into T1w space (if required)
-    nonstd_spaces = set(spaces.get_nonstandard())
-    if nonstd_spaces.intersection(("T1w", "anat")):
+    nonstd_spaces = frozenset(spaces.get_nonstandard())
+    if nonstd_spaces & {"T1w", "anat"}:
         from niworkflows.interfaces.fixes import (
             FixHeaderApplyTransforms as ApplyTransforms,
         )
@@ -526,7 +553,7 @@ Non-gridded (surface) resamplings were performed using `mri_vol2surf`
         ])
         # fmt:on
 
-    if nonstd_spaces.intersection(("func", "run", "bold", "boldref", "sbref")):
+    if nonstd_spaces & {"func", "run", "bold", "boldref", "sbref"}:
         # fmt:off
         workflow.connect([
             (bold_bold_trans_wf, outputnode, [
@@ -537,7 +564,7 @@ Non-gridded (surface) resamplings were performed using `mri_vol2surf`
         ])
         # fmt:on
 
-    if spaces.get_spaces(nonstandard=False, dim=(3,)):
+    if std_spaces_3d:
         # Apply transforms in 1 shot
         # Only use uncompressed output if AROMA is to be run
         bold_std_trans_wf = init_bold_std_trans_wf(
@@ -553,6 +580,7 @@ Non-gridded (surface) resamplings were performed using `mri_vol2surf`
             (inputnode, bold_std_trans_wf, [
                 ('template', 'inputnode.templates'),
                 ('anat2std_xfm', 'inputnode.anat2std_xfm'),
+                ('ref_file', 'inputnode.bold_ref'),
                 ('bold_file', 'inputnode.name_source')]),
             (t1w_mask_bold_tfm, bold_std_trans_wf, [('output_image', 'inputnode.bold_mask')]),
             (lta_convert, bold_std_trans_wf, [
@@ -568,15 +596,13 @@ Non-gridded (surface) resamplings were performed using `mri_vol2surf`
         if not multiecho:
             # fmt:off
             workflow.connect([
-                (bold_split, bold_std_trans_wf, [("out_files", "inputnode.bold_split")]),
+                (boldbuffer, bold_std_trans_wf, [("bold_file", "inputnode.bold_split")]),
             ])
             # fmt:on
         else:
-            split_opt_comb = bold_split.clone(name="split_opt_comb")
             # fmt:off
             workflow.connect([
-                (bold_t2s_wf, split_opt_comb, [('outputnode.bold', 'in_file')]),
-                (split_opt_comb, bold_std_trans_wf, [('out_files', 'inputnode.bold_split')])
+                (bold_t2s_wf, bold_std_trans_wf, [('outputnode.bold', 'inputnode.bold_file')]),
             ])
             # fmt:on
 
@@ -594,6 +620,7 @@ Non-gridded (surface) resamplings were performed using `mri_vol2surf`
         # fmt:on
 
         if config.workflow.use_aroma:  # ICA-AROMA workflow
+            from ...interfaces import JoinConfounds
             from .confounds import init_ica_aroma_wf
 
             ica_aroma_wf = init_ica_aroma_wf(
@@ -606,10 +633,7 @@ Non-gridded (surface) resamplings were performed using `mri_vol2surf`
                 name="ica_aroma_wf",
             )
 
-            join = pe.Node(
-                niu.Function(output_names=["out_file"], function=_to_join),
-                name="aroma_confounds",
-            )
+            join = pe.Node(JoinConfounds(), name="aroma_confounds")
 
             mrg_conf_metadata = pe.Node(
                 niu.Merge(2),
@@ -623,14 +647,6 @@ Non-gridded (surface) resamplings were performed using `mri_vol2surf`
             )
 
             # fmt:off
-            workflow.disconnect([
-                (bold_confounds_wf, outputnode, [
-                    ('outputnode.confounds_file', 'confounds'),
-                ]),
-                (bold_confounds_wf, outputnode, [
-                    ('outputnode.confounds_metadata', 'confounds_metadata'),
-                ]),
-            ])
             workflow.connect([
                 (inputnode, ica_aroma_wf, [
                     ('bold_file', 'inputnode.name_source'),
@@ -659,7 +675,7 @@ Non-gridded (surface) resamplings were performed using `mri_vol2surf`
             ])
             # fmt:on
 
-    if spaces.get_spaces(nonstandard=False, dim=(3,)):
+    if std_spaces_3d:
         carpetplot_wf = init_carpetplot_wf(
             mem_gb=mem_gb["resampled"],
             metadata=metadata,
@@ -719,17 +735,81 @@ Non-gridded (surface) resamplings were performed using `mri_vol2surf`
     # fmt:on
 
     # Fill-in datasinks of reportlets seen so far
-    for node in workflow.list_node_names():
-        if node.split(".")[-1].startswith("ds_report"):
-            workflow.get_node(node).inputs.base_directory = output_dir
-            workflow.get_node(node).inputs.source_file = ref_file
+    for name in workflow.list_node_names():
+        if name.split(".")[-1].startswith("ds_report"):
+            node = workflow.get_node(name)
+            node.inputs.base_directory = output_dir
+            node.inputs.source_file = ref_file
 
     return workflow
 
 
+def index_sbrefs(layout, subject_id):
+    """
+    Index the single-band references of a participant with one layout query.
+
+    Returns a :obj:`dict` mapping the BIDS entities shared with the
+    corresponding BOLD run (all but suffix, extension and echo) to a list of
+    ``(echo, path)`` pairs, to be passed to :py:func:`init_func_preproc_wf`.
+
+    """
+    from collections import defaultdict
+
+    index = defaultdict(list)
+    for sbref in layout.get(
+        subject=subject_id,
+        suffix="sbref",
+        extension=["nii", "nii.gz"],
+        return_type="file",
+    ):
+        entities = layout.parse_file_entities(sbref)
+        index[_sbref_key(entities)].append((entities.get("echo"), sbref))
+    return dict(index)
+
+
+def _lookup_sbrefs(sbref_index, entities):
+    """Select sbrefs matching all entities of a BOLD run, as a layout query would."""
+    query = set(_sbref_key(entities))
+    # Compare as strings, like the other entities (echo may be parsed as int)
+    echoes = {str(echo) for echo in listify(entities.get("echo", []))}
+    return sorted(
+        sbref
+        for key, sbrefs in sbref_index.items()
+        if query.issubset(key)
+        for echo, sbref in sbrefs
+        if not echoes or str(echo) in echoes
+    )
+
+
+def _sbref_key(entities):
+    return tuple(
+        sorted(
+            (key, str(value))
+            for key, value in entities.items()
+            if key not in _SBREF_IGNORED_ENTITIES
+        )
+    )
+
+
+@lru_cache(maxsize=4096)
+def _get_metadata(layout, bold_fname):
+    """Query a BIDS layout for the metadata of a file, once per layout and path."""
+    return layout.get_metadata(bold_fname)
+
+
+@lru_cache(maxsize=4096)
+def _load_header(bold_fname, mtime):
+    """Parse an image header once per file (``mtime`` invalidates stale entries)."""
+    import nibabel as nb
+
+    return nb.load(bold_fname, mmap=False).header
+
+
 def _create_mem_gb(bold_fname):
-    bold_size_gb = os.path.getsize(bold_fname) / (1024 ** 3)
-    bold_tlen = nb.load(bold_fname).shape[-1]
+    stat = os.stat(bold_fname)
+    bold_size_gb = stat.st_size / _GB
+    header = _load_header(bold_fname, stat.st_mtime)
+    bold_tlen = header.get_data_shape()[-1]
     mem_gb = {
         "filesize": bold_size_gb,
         "resampled": bold_size_gb * 4,
@@ -739,6 +819,7 @@ def _create_mem_gb(bold_fname):
     return bold_tlen, mem_gb
 
 
+@lru_cache(maxsize=None)
 def _get_wf_name(bold_fname):
     """
     Derive the workflow name for supplied BOLD file.
@@ -755,18 +836,8 @@ def _get_wf_name(bold_fname):
     fname_nosub = "_".join(fname.split("_")[1:])
     # if 'echo' in fname_nosub:
     #     fname_nosub = '_'.join(fname_nosub.split("_echo-")[:1]) + "_bold"
-    name = "func_preproc_" + fname_nosub.replace(".", "_").replace(" ", "").replace(
-        "-", "_"
-    ).replace("_bold", "_wf")
+    name = "func_preproc_" + fname_nosub.translate(_WF_NAME_TABLE).replace(
+        "_bold", "_wf"
+    )
 
     return name
-
-
-def _to_join(in_file, join_file):
-    """Join two tsv files if the join_file is not ``None``."""
-    from niworkflows.interfaces.utility import JoinTSVColumns
-
-    if join_file is None:
-        return in_file
-    res = JoinTSVColumns(in_file=in_file, join_file=join_file).run()
-    return res.outputs.out_file
@@ -127,25 +127,22 @@ def init_bold_confs_wf(
     from niworkflows.engine.workflows import LiterateWorkflow as Workflow
     from niworkflows.interfaces.confounds import ExpandModel, SpikeRegressors
     from niworkflows.interfaces.fixes import FixHeaderApplyTransforms as ApplyTransforms
-    from niworkflows.interfaces.images import SignalExtraction
     from niworkflows.interfaces.reportlets.masks import ROIsPlot
-    from niworkflows.interfaces.patches import (
-        RobustACompCor as ACompCor,
-        RobustTCompCor as TCompCor,
-    )
     from niworkflows.interfaces.plotting import (
         CompCorVariancePlot,
         ConfoundsCorrelationPlot,
     )
-    from niworkflows.interfaces.probmaps import (
-        TPM2ROI,
-        AddTPMs,
-    )
+    from niworkflows.interfaces.probmaps import AddTPMs
     from niworkflows.interfaces.utility import (
-        AddTSVHeader,
         TSV2JSON,
         DictMerge,
     )
+    from ...interfaces.signals import SignalExtraction
+    from ...interfaces.patches import (
+        RobustACompCor as ACompCor,
+        RobustTCompCor as TCompCor,
+    )
+    from ...interfaces.probmaps import TPM2ROI
 
     workflow = Workflow(name=name)
     workflow.__desc__ = """\
@@ -155,8 +152,8 @@ three region-wise global signals.
 FD was computed using two formulations following Power (absolute sum of
 relative motions, @power_fd_dvars) and Jenkinson (relative root mean square
 displacement between affines, @mcflirt).
-FD and DVARS are calculated for each functional run, both using their
-implementations in *Nipype* [following the definitions by @power_fd_dvars].
+FD and DVARS are calculated for each functional run, following the
+definitions by @power_fd_dvars (DVARS with its implementation in *Nipype*).
 The three global signals are extracted within the CSF, the WM, and
 the whole-brain masks.
 Additionally, a set of physiological regressors were extracted to
@@ -221,39 +218,33 @@ were annotated as motion outliers.
         name="wm_roi",
     )
     acc_roi = pe.Node(
-        TPM2ROI(
-            erode_prop=0.6, mask_erode_prop=0.6 ** 3
-        ),  # 0.6 = radius; 0.6^3 = volume
+        TPM2ROI(erode_prop=0.6),  # reuses the eroded mask of wm_roi
         name="acc_roi",
     )
 
-    # Map ROIs in T1w space into BOLD space
-    csf_tfm = pe.Node(
-        ApplyTransforms(interpolation="NearestNeighbor", float=True),
-        name="csf_tfm",
-        mem_gb=0.1,
-    )
-    wm_tfm = pe.Node(
-        ApplyTransforms(interpolation="NearestNeighbor", float=True),
-        name="wm_tfm",
-        mem_gb=0.1,
-    )
-    acc_tfm = pe.Node(
-        ApplyTransforms(interpolation="NearestNeighbor", float=True),
-        name="acc_tfm",
-        mem_gb=0.1,
-    )
-    tcc_tfm = pe.Node(
-        ApplyTransforms(interpolation="NearestNeighbor", float=True),
-        name="tcc_tfm",
+    # Map ROIs in T1w space into BOLD space, packed as bits of a single
+    # label image ([acc, csf, wm, tcc]) so that ANTs is only called once
+    mrg_rois = pe.Node(niu.Merge(4), name="merge_rois_t1w", run_without_submitting=True)
+    pack_rois = pe.Node(niu.Function(function=_pack_rois), name="pack_rois")
+    rois_tfm = pe.Node(
+        ApplyTransforms(
+            interpolation="NearestNeighbor",
+            float=True,
+            args="-u uchar",  # write labels as uint8 rather than float32
+        ),
+        name="rois_tfm",
         mem_gb=0.1,
     )
 
-    # Ensure ROIs don't go off-limits (reduced FoV)
-    csf_msk = pe.Node(niu.Function(function=_maskroi), name="csf_msk")
-    wm_msk = pe.Node(niu.Function(function=_maskroi), name="wm_msk")
-    acc_msk = pe.Node(niu.Function(function=_maskroi), name="acc_msk")
-    tcc_msk = pe.Node(niu.Function(function=_maskroi), name="tcc_msk")
+    # Unpack ROIs and ensure they don't go off-limits (reduced FoV)
+    mask_rois = pe.Node(niu.Function(function=_unpack_rois), name="mask_rois")
+
+    # Decompress BOLD once for the five nodes below reading it
+    stage_bold = pe.Node(
+        niu.Function(function=_stage_bold),
+        name="stage_bold",
+        mem_gb=DEFAULT_MEMORY_MIN_GB,
+    )
 
     # DVARS
     dvars = pe.Node(
@@ -264,14 +255,12 @@ were annotated as motion outliers.
 
     # Frame displacement
     fdisp = pe.Node(
-        nac.FramewiseDisplacement(parameter_source="SPM"), name="fdisp", mem_gb=mem_gb
+        niu.Function(function=_framewise_displacement, output_names=["out_file"]),
+        name="fdisp",
+        mem_gb=mem_gb,
     )
 
     # a/t-CompCor
-    mrg_lbl_cc = pe.Node(
-        niu.Merge(3), name="merge_rois_cc", run_without_submitting=True
-    )
-
     tcompcor = pe.Node(
         TCompCor(
             components_file="tcompcor.tsv",
@@ -316,34 +305,14 @@ were annotated as motion outliers.
 
     # Global and segment regressors
     signals_class_labels = ["csf", "white_matter", "global_signal"]
-    mrg_lbl = pe.Node(niu.Merge(3), name="merge_rois", run_without_submitting=True)
+    mrg_lbl = pe.Node(niu.Merge(2), name="merge_rois", run_without_submitting=True)
     signals = pe.Node(
         SignalExtraction(class_labels=signals_class_labels),
         name="signals",
         mem_gb=mem_gb,
     )
 
-    # Arrange confounds
-    add_dvars_header = pe.Node(
-        AddTSVHeader(columns=["dvars"]),
-        name="add_dvars_header",
-        mem_gb=0.01,
-        run_without_submitting=True,
-    )
-    add_std_dvars_header = pe.Node(
-        AddTSVHeader(columns=["std_dvars"]),
-        name="add_std_dvars_header",
-        mem_gb=0.01,
-        run_without_submitting=True,
-    )
-    add_motion_headers = pe.Node(
-        AddTSVHeader(
-            columns=["trans_x", "trans_y", "trans_z", "rot_x", "rot_y", "rot_z"]
-        ),
-        name="add_motion_headers",
-        mem_gb=0.01,
-        run_without_submitting=True,
-    )
+    # Arrange confounds (headers of DVARS and motion files are set here)
     # add_rmsd_header = pe.Node(
     #     AddTSVHeader(columns=["rmsd"]),
     #     name="add_rmsd_header",
@@ -351,7 +320,14 @@ were annotated as motion outliers.
     #     run_without_submitting=True,
     # )
     concat = pe.Node(
-        GatherConfounds(), name="concat", mem_gb=0.01, run_without_submitting=True
+        GatherConfounds(
+            dvars_columns=["dvars"],
+            std_dvars_columns=["std_dvars"],
+            motion_columns=["trans_x", "trans_y", "trans_z", "rot_x", "rot_y", "rot_z"],
+        ),
+        name="concat",
+        mem_gb=0.01,
+        run_without_submitting=True,
     )
 
     # CompCor metadata
@@ -455,6 +431,18 @@ were annotated as motion outliers.
     def _pick_wm(files):
         return files[1]  # after smriprep#189, this is BIDS-compliant.
 
+    def _acc_rois(files):
+        return files[:3]  # combined, CSF, WM
+
+    def _signal_rois(files):
+        return files[1:3]  # CSF, WM
+
+    def _pick_acc(files):
+        return files[0]
+
+    def _pick_tcc(files):
+        return files[3]
+
     # fmt:off
     workflow.connect([
         # Massage ROIs (in T1w space)
@@ -464,68 +452,53 @@ were annotated as motion outliers.
         (inputnode, wm_roi, [(('anat_tpms', _pick_wm), 'in_tpm'),
                              ('t1w_mask', 'in_mask')]),
         (inputnode, acc_roi, [('t1w_mask', 'in_mask')]),
+        (wm_roi, acc_roi, [('eroded_mask', 'in_eroded_mask')]),
         (acc_tpm, acc_roi, [('out_file', 'in_tpm')]),
         # Map ROIs to BOLD
-        (inputnode, csf_tfm, [('bold_mask', 'reference_image'),
-                              ('anat2bold', 'transforms')]),
-        (csf_roi, csf_tfm, [('roi_file', 'input_image')]),
-        (inputnode, wm_tfm, [('bold_mask', 'reference_image'),
-                             ('anat2bold', 'transforms')]),
-        (wm_roi, wm_tfm, [('roi_file', 'input_image')]),
-        (inputnode, acc_tfm, [('bold_mask', 'reference_image'),
-                              ('anat2bold', 'transforms')]),
-        (acc_roi, acc_tfm, [('roi_file', 'input_image')]),
-        (inputnode, tcc_tfm, [('bold_mask', 'reference_image'),
-                              ('anat2bold', 'transforms')]),
-        (csf_roi, tcc_tfm, [('eroded_mask', 'input_image')]),
+        (acc_roi, mrg_rois, [('roi_file', 'in1')]),
+        (csf_roi, mrg_rois, [('roi_file', 'in2'),
+                             ('eroded_mask', 'in4')]),
+        (wm_roi, mrg_rois, [('roi_file', 'in3')]),
+        (mrg_rois, pack_rois, [('out', 'in_files')]),
+        (inputnode, rois_tfm, [('bold_mask', 'reference_image'),
+                               ('anat2bold', 'transforms')]),
+        (pack_rois, rois_tfm, [('out', 'input_image')]),
         # Mask ROIs with bold_mask
-        (inputnode, csf_msk, [('bold_mask', 'in_mask')]),
-        (inputnode, wm_msk, [('bold_mask', 'in_mask')]),
-        (inputnode, acc_msk, [('bold_mask', 'in_mask')]),
-        (inputnode, tcc_msk, [('bold_mask', 'in_mask')]),
+        (inputnode, mask_rois, [('bold_mask', 'in_mask')]),
+        (rois_tfm, mask_rois, [('output_image', 'in_file')]),
         # connect inputnode to each non-anatomical confound node
-        (inputnode, dvars, [('bold', 'in_file'),
-                            ('bold_mask', 'in_mask')]),
+        (inputnode, stage_bold, [('bold', 'in_file')]),
+        (stage_bold, dvars, [('out', 'in_file')]),
+        (inputnode, dvars, [('bold_mask', 'in_mask')]),
         (inputnode, fdisp, [('movpar_file', 'in_file')]),
 
         # tCompCor
-        (inputnode, tcompcor, [('bold', 'realigned_file')]),
+        (stage_bold, tcompcor, [('out', 'realigned_file')]),
         (inputnode, tcompcor, [('skip_vols', 'ignore_initial_volumes')]),
-        (tcc_tfm, tcc_msk, [('output_image', 'roi_file')]),
-        (tcc_msk, tcompcor, [('out', 'mask_files')]),
+        (mask_rois, tcompcor, [(('out', _pick_tcc), 'mask_files')]),
 
         # aCompCor
-        (inputnode, acompcor, [('bold', 'realigned_file')]),
+        (stage_bold, acompcor, [('out', 'realigned_file')]),
         (inputnode, acompcor, [('skip_vols', 'ignore_initial_volumes')]),
-        (acc_tfm, acc_msk, [('output_image', 'roi_file')]),
-        (acc_msk, mrg_lbl_cc, [('out', 'in1')]),
-        (csf_msk, mrg_lbl_cc, [('out', 'in2')]),
-        (wm_msk, mrg_lbl_cc, [('out', 'in3')]),
-        (mrg_lbl_cc, acompcor, [('out', 'mask_files')]),
+        (mask_rois, acompcor, [(('out', _acc_rois), 'mask_files')]),
 
         # Global signals extraction (constrained by anatomy)
-        (inputnode, signals, [('bold', 'in_file')]),
-        (csf_tfm, csf_msk, [('output_image', 'roi_file')]),
-        (csf_msk, mrg_lbl, [('out', 'in1')]),
-        (wm_tfm, wm_msk, [('output_image', 'roi_file')]),
-        (wm_msk, mrg_lbl, [('out', 'in2')]),
-        (inputnode, mrg_lbl, [('bold_mask', 'in3')]),
+        (stage_bold, signals, [('out', 'in_file')]),
+        (mask_rois, mrg_lbl, [(('out', _signal_rois), 'in1')]),
+        (inputnode, mrg_lbl, [('bold_mask', 'in2')]),
         (mrg_lbl, signals, [('out', 'label_files')]),
 
         # Collate computed confounds together
-        (inputnode, add_motion_headers, [('movpar_file', 'in_file')]),
+        (inputnode, concat, [('movpar_file', 'motion')]),
         # (inputnode, add_rmsd_header, [('rmsd_file', 'in_file')]),
-        (dvars, add_dvars_header, [('out_nstd', 'in_file')]),
-        (dvars, add_std_dvars_header, [('out_std', 'in_file')]),
+        (dvars, concat, [('out_nstd', 'dvars'),
+                         ('out_std', 'std_dvars')]),
         (signals, concat, [('out_file', 'signals')]),
         (fdisp, concat, [('out_file', 'fd')]),
         (tcompcor, concat, [('components_file', 'tcompcor'),
                             ('pre_filter_file', 'cos_basis')]),
         (acompcor, concat, [('components_file', 'acompcor')]),
-        (add_motion_headers, concat, [('out_file', 'motion')]),
         # (add_rmsd_header, concat, [('out_file', 'rmsd')]),
-        (add_dvars_header, concat, [('out_file', 'dvars')]),
-        (add_std_dvars_header, concat, [('out_file', 'std_dvars')]),
 
         # Confounds metadata
         (tcompcor, tcc_metadata_fmt, [('metadata_file', 'in_file')]),
@@ -541,10 +514,10 @@ were annotated as motion outliers.
         # Set outputs
         (spike_regress, outputnode, [('confounds_file', 'confounds_file')]),
         (mrg_conf_metadata2, outputnode, [('out_dict', 'confounds_metadata')]),
-        (inputnode, rois_plot, [('bold', 'in_file'),
-                                ('bold_mask', 'in_mask')]),
+        (stage_bold, rois_plot, [('out', 'in_file')]),
+        (inputnode, rois_plot, [('bold_mask', 'in_mask')]),
         (tcompcor, mrg_compcor, [('high_variance_masks', 'in1')]),
-        (acc_msk, mrg_compcor, [('out', 'in2')]),
+        (mask_rois, mrg_compcor, [(('out', _pick_acc), 'in2')]),
         (mrg_compcor, rois_plot, [('out', 'in_rois')]),
         (rois_plot, ds_report_bold_rois, [('out_report', 'in_file')]),
         (tcompcor, mrg_cc_metadata, [('metadata_file', 'in1')]),
@@ -619,7 +592,7 @@ def init_carpetplot_wf(mem_gb, metadata, name="bold_carpet_wf"):
     )
 
     # List transforms
-    mrg_xfms = pe.Node(niu.Merge(2), name="mrg_xfms")
+    mrg_xfms = pe.Node(niu.Merge(2), name="mrg_xfms", run_without_submitting=True)
 
     # Warp segmentation into EPI space
     resample_parc = pe.Node(
@@ -768,9 +741,9 @@ def init_ica_aroma_wf(
         Used to recover original information lost during processing
     skip_vols
         number of non steady state volumes
-    bold_split
-        Individual 3D BOLD volumes, not motion corrected
-    bold_mask
+    bold_std
+        BOLD series in template space, not smoothed
+    bold_mask_std
         BOLD series mask in template space
     hmc_xforms
         List of affine transforms aligning each volume to ``ref_image`` in ITK format
@@ -842,11 +815,6 @@ in the corresponding confounds file.
     )
     select_std.inputs.key = "MNI152NLin6Asym_res-2"
 
-    rm_non_steady_state = pe.Node(
-        niu.Function(function=_remove_volumes, output_names=["bold_cut"]),
-        name="rm_nonsteady",
-    )
-
     calc_median_val = pe.Node(
         fsl.ImageStats(op_string="-k %s -p 50"), name="calc_median_val"
     )
@@ -886,11 +854,6 @@ in the corresponding confounds file.
         name="ica_aroma",
     )
 
-    add_non_steady_state = pe.Node(
-        niu.Function(function=_add_volumes, output_names=["bold_add"]),
-        name="add_nonsteady",
-    )
-
     # extract the confound ICs from the results
     ica_aroma_confound_extraction = pe.Node(
         ICAConfounds(err_on_aroma_warn=err_on_aroma_warn),
@@ -931,21 +894,11 @@ in the corresponding confounds file.
                                  ('bold_std', 'bold_std'),
                                  ('bold_mask_std', 'bold_mask_std')]),
         (inputnode, ica_aroma, [('movpar_file', 'motion_parameters')]),
-        (inputnode, rm_non_steady_state, [
-            ('skip_vols', 'skip_vols')]),
-        (select_std, rm_non_steady_state, [
-            ('bold_std', 'bold_file')]),
         (select_std, calc_median_val, [
             ('bold_mask_std', 'mask_file')]),
-        (rm_non_steady_state, calc_median_val, [
-            ('bold_cut', 'in_file')]),
-        (rm_non_steady_state, calc_bold_mean, [
-            ('bold_cut', 'in_file')]),
         (calc_bold_mean, getusans, [('out_file', 'image')]),
         (calc_median_val, getusans, [('out_stat', 'thresh')]),
         # Connect input nodes to complete smoothing
-        (rm_non_steady_state, smooth, [
-            ('bold_cut', 'in_file')]),
         (getusans, smooth, [('usans', 'usans')]),
         (calc_median_val, smooth, [(('out_stat', _getbtthresh), 'brightness_threshold')]),
         # connect smooth to melodic
@@ -960,8 +913,6 @@ in the corresponding confounds file.
         (melodic, ica_aroma, [('out_dir', 'melodic_dir')]),
         # generate tsvs from ICA-AROMA
         (ica_aroma, ica_aroma_confound_extraction, [('out_dir', 'in_directory')]),
-        (inputnode, ica_aroma_confound_extraction, [
-            ('skip_vols', 'skip_vols')]),
         (ica_aroma_confound_extraction, ica_aroma_metadata_fmt, [
             ('aroma_metadata', 'in_file')]),
         # output for processing and reporting
@@ -969,39 +920,92 @@ in the corresponding confounds file.
                                                      ('aroma_noise_ics', 'aroma_noise_ics'),
                                                      ('melodic_mix', 'melodic_mix')]),
         (ica_aroma_metadata_fmt, outputnode, [('output', 'aroma_metadata')]),
+        (ica_aroma, ds_report_ica_aroma, [('out_report', 'in_file')]),
+    ])
+    # fmt:on
+
+    # Non steady state volumes are only known at runtime: when there are none,
+    # rm_nonsteady and add_nonsteady pass the series through without reading it
+    rm_non_steady_state = pe.Node(
+        niu.Function(function=_remove_volumes, output_names=["bold_cut"]),
+        name="rm_nonsteady",
+    )
+    add_non_steady_state = pe.Node(
+        niu.Function(function=_add_volumes, output_names=["bold_add"]),
+        name="add_nonsteady",
+    )
+
+    # fmt:off
+    workflow.connect([
+        (inputnode, ica_aroma_confound_extraction, [('skip_vols', 'skip_vols')]),
+        (inputnode, rm_non_steady_state, [('skip_vols', 'skip_vols')]),
+        (inputnode, add_non_steady_state, [('skip_vols', 'skip_vols')]),
+        (select_std, rm_non_steady_state, [('bold_std', 'bold_file')]),
+        (rm_non_steady_state, calc_median_val, [('bold_cut', 'in_file')]),
+        (rm_non_steady_state, calc_bold_mean, [('bold_cut', 'in_file')]),
+        (rm_non_steady_state, smooth, [('bold_cut', 'in_file')]),
         (ica_aroma, add_non_steady_state, [
             ('nonaggr_denoised_file', 'bold_cut_file')]),
-        (select_std, add_non_steady_state, [
-            ('bold_std', 'bold_file')]),
-        (inputnode, add_non_steady_state, [
-            ('skip_vols', 'skip_vols')]),
+        (select_std, add_non_steady_state, [('bold_std', 'bold_file')]),
         (add_non_steady_state, outputnode, [('bold_add', 'nonaggr_denoised_file')]),
-        (ica_aroma, ds_report_ica_aroma, [('out_report', 'in_file')]),
     ])
     # fmt:on
 
     return workflow
 
 
+def _stage_bold(in_file):
+    """Decompress the BOLD series once, keeping its data type and scaling."""
+    import os
+    import gzip
+    import shutil
+    from nipype.utils.filemanip import fname_presuffix
+
+    if not in_file.endswith(".gz"):
+        return in_file
+
+    out = fname_presuffix(in_file, suffix=".nii", newpath=os.getcwd(), use_ext=False)
+    with gzip.open(in_file, "rb") as f_in, open(out, "wb") as f_out:
+        shutil.copyfileobj(f_in, f_out, 1 << 24)
+    return out
+
+
+def _framewise_displacement(in_file, radius=50.0):
+    """Calculate FD (Power et al., 2012) from SPM-formatted motion parameters."""
+    import os
+    import numpy as np
+
+    diff = np.diff(np.loadtxt(in_file, ndmin=2)[:, :6], axis=0)
+    diff[:, 3:] *= radius  # rotations (rad) to displacements on a sphere (mm)
+
+    out_file = os.path.abspath("fd_power_2012.txt")
+    np.savetxt(
+        out_file,
+        np.abs(diff).sum(axis=1),
+        header="FramewiseDisplacement",
+        comments="",
+    )
+    return out_file
+
+
 def _remove_volumes(bold_file, skip_vols):
     """Remove skip_vols from bold_file."""
+    import os
     import nibabel as nb
     from nipype.utils.filemanip import fname_presuffix
 
     if skip_vols == 0:
         return bold_file
 
-    out = fname_presuffix(bold_file, suffix="_cut")
-    bold_img = nb.load(bold_file)
-    bold_img.__class__(
-        bold_img.dataobj[..., skip_vols:], bold_img.affine, bold_img.header
-    ).to_filename(out)
+    out = fname_presuffix(bold_file, suffix="_cut", newpath=os.getcwd())
+    nb.load(bold_file, keep_file_open=True).slicer[..., skip_vols:].to_filename(out)
 
     return out
 
 
 def _add_volumes(bold_file, bold_cut_file, skip_vols):
     """Prepend skip_vols from bold_file onto bold_cut_file."""
+    import os
     import nibabel as nb
     import numpy as np
     from nipype.utils.filemanip import fname_presuffix
@@ -1012,27 +1016,66 @@ def _add_volumes(bold_file, bold_cut_file, skip_vols):
     bold_img = nb.load(bold_file)
     bold_cut_img = nb.load(bold_cut_file)
 
-    bold_data = np.concatenate(
-        (bold_img.dataobj[..., :skip_vols], bold_cut_img.dataobj), axis=3
+    # Fill a preallocated array (volume by volume for the cut series), so that
+    # no full-size temporary is created on top of the output
+    head = np.asanyarray(bold_img.dataobj[..., :skip_vols])
+    n_cut = bold_cut_img.shape[3]
+    cut_vol = np.asanyarray(bold_cut_img.dataobj[..., 0])
+    bold_data = np.empty(
+        head.shape[:3] + (skip_vols + n_cut,), dtype=np.result_type(head, cut_vol)
     )
+    bold_data[..., :skip_vols] = head
+    bold_data[..., skip_vols] = cut_vol
+    for i in range(1, n_cut):
+        bold_data[..., skip_vols + i] = bold_cut_img.dataobj[..., i]
 
-    out = fname_presuffix(bold_cut_file, suffix="_addnonsteady")
+    out = fname_presuffix(bold_cut_file, suffix="_addnonsteady", newpath=os.getcwd())
     bold_img.__class__(bold_data, bold_img.affine, bold_img.header).to_filename(out)
 
     return out
 
 
-def _maskroi(in_mask, roi_file):
+def _pack_rois(in_files):
+    """Pack a list of binary ROIs as the bits of a single uint8 label image."""
+    import os
     import numpy as np
     import nibabel as nb
     from nipype.utils.filemanip import fname_presuffix
 
-    roi = nb.load(roi_file)
-    roidata = roi.get_data().astype(np.uint8)
-    msk = nb.load(in_mask).get_data().astype(bool)
-    roidata[~msk] = 0
-    roi.set_data_dtype(np.uint8)
+    if len(in_files) > 8:
+        raise ValueError("Cannot pack more than 8 ROIs in a uint8 image.")
+
+    ref = nb.load(in_files[0])
+    packed = np.zeros(ref.shape[:3], dtype=np.uint8)
+    for bit, fname in enumerate(in_files):
+        packed |= (np.asanyarray(nb.load(fname).dataobj) > 0).astype(np.uint8) << bit
+
+    hdr = ref.header.copy()
+    hdr.set_data_dtype(np.uint8)
+    out = fname_presuffix(in_files[0], suffix="_packed", newpath=os.getcwd())
+    ref.__class__(packed, ref.affine, hdr).to_filename(out)
+    return out
+
+
+def _unpack_rois(in_mask, in_file, nrois=4):
+    """Split a bit-packed label image into binary ROIs masked by ``in_mask``."""
+    import os
+    import numpy as np
+    import nibabel as nb
+    from nipype.utils.filemanip import fname_presuffix
+
+    img = nb.load(in_file)
+    packed = np.asanyarray(img.dataobj).astype(np.uint8)
+    packed *= np.asanyarray(nb.load(in_mask).dataobj) != 0
+
+    hdr = img.header.copy()
+    hdr.set_data_dtype(np.uint8)
 
-    out = fname_presuffix(roi_file, suffix="_boldmsk")
-    roi.__class__(roidata, roi.affine, roi.header).to_filename(out)
+    out = []
+    for bit in range(nrois):
+        out.append(
+            fname_presuffix(in_file, suffix="_boldmsk%d" % bit, newpath=os.getcwd())
+        )
+        roidata = (packed >> bit) & 1
+        img.__class__(roidata, img.affine, hdr).to_filename(out[-1])
     return out
@@ -8,17 +8,28 @@ Registration workflows
 .. autofunction:: init_bold_t1_trans_wf
 
 """
+from functools import lru_cache
+
 from ... import config
 
 from nipype.pipeline import engine as pe
-from nipype.interfaces import utility as niu, fsl, c3
+from nipype.interfaces import utility as niu
+from niworkflows.engine.workflows import LiterateWorkflow as Workflow
+from niworkflows.interfaces.reportlets.registration import FLIRTRPT
 
 from ...interfaces import DerivativesDataSink
+from ...interfaces.resampling import ResampleSeries
 
 DEFAULT_MEMORY_MIN_GB = config.DEFAULT_MEMORY_MIN_GB
 LOGGER = config.loggers.workflow
 
 
+@lru_cache(maxsize=1)
+def _flirt_version():
+    """Look FLIRT's version up once, instead of on every workflow built."""
+    return FLIRTRPT().version
+
+
 def init_bold_reg_wf(
     bold2t1w_dof,
     bold2t1w_init,
@@ -82,16 +93,13 @@ def init_bold_reg_wf(
         Reportlet for assessing registration quality
 
     """
-    from niworkflows.engine.workflows import LiterateWorkflow as Workflow
-    from niworkflows.interfaces.reportlets.registration import FLIRTRPT
-
     workflow = Workflow(name=name)
     workflow.__desc__ = """\
 The BOLD reference was then co-registered to the T2w reference using
 `flirt` [FSL {fsl_ver}, @flirt].
 Co-registration was configured with six degrees of freedom.
 """.format(
-        fsl_ver=FLIRTRPT().version or "<ver>"
+        fsl_ver=_flirt_version() or "<ver>"
     )
     inputnode = pe.Node(
         niu.IdentityInterface(fields=["ref_bold_brain", "t1w_brain"]), name="inputnode"
@@ -120,20 +128,11 @@ Co-registration was configured with six degrees of freedom.
             "Header-based registration initialization not supported for FSL"
         )
 
-    invt_xfm = pe.Node(
-        fsl.ConvertXFM(invert_xfm=True), name="invt_xfm", mem_gb=DEFAULT_MEMORY_MIN_GB
-    )
-
-    # BOLD to T1 transform matrix is from fsl, using c3 tools to convert to
-    # something ANTs will like.
-    fsl2itk_fwd = pe.Node(
-        c3.C3dAffineTool(fsl2ras=True, itk_transform=True),
-        name="fsl2itk_fwd",
-        mem_gb=DEFAULT_MEMORY_MIN_GB,
-    )
-    fsl2itk_inv = pe.Node(
-        c3.C3dAffineTool(fsl2ras=True, itk_transform=True),
-        name="fsl2itk_inv",
+    # BOLD to T1 transform matrix is from fsl, convert it (and its inverse)
+    # to something ANTs will like.
+    fsl2itk = pe.Node(
+        niu.Function(function=_fsl2itk, output_names=["itk_fwd", "itk_inv"]),
+        name="fsl2itk",
         mem_gb=DEFAULT_MEMORY_MIN_GB,
     )
 
@@ -141,16 +140,12 @@ Co-registration was configured with six degrees of freedom.
     workflow.connect([
         (inputnode, coreg, [('ref_bold_brain', 'in_file'),
                             ('t1w_brain', 'reference')]),
-        (coreg, invt_xfm, [('out_matrix_file', 'in_file')]),
-        (coreg, fsl2itk_fwd, [('out_matrix_file', 'transform_file')]),
+        (coreg, fsl2itk, [('out_matrix_file', 'in_xfm')]),
         (coreg, outputnode, [('out_report', 'out_report')]),
-        (inputnode, fsl2itk_fwd, [('t1w_brain', 'reference_file'),
-                                  ('ref_bold_brain', 'source_file')]),
-        (inputnode, fsl2itk_inv, [('ref_bold_brain', 'reference_file'),
-                                  ('t1w_brain', 'source_file')]),
-        (invt_xfm, fsl2itk_inv, [('out_file', 'transform_file')]),
-        (fsl2itk_fwd, outputnode, [('itk_transform', 'bold2anat')]),
-        (fsl2itk_inv, outputnode, [('itk_transform', 'anat2bold')]),
+        (inputnode, fsl2itk, [('t1w_brain', 'reference_file'),
+                              ('ref_bold_brain', 'source_file')]),
+        (fsl2itk, outputnode, [('itk_fwd', 'bold2anat'),
+                               ('itk_inv', 'anat2bold')]),
     ])
     # fmt:on
 
@@ -220,7 +215,7 @@ def init_bold_t1_trans_wf(
     t1w_mask
         Mask of the skull-stripped template image
     bold_split
-        Individual 3D BOLD volumes, not motion corrected
+        BOLD series (4D) or its individual 3D volumes, not motion corrected
     hmc_xforms
         List of affine transforms aligning each volume to ``ref_image`` in ITK format
     bold2anat
@@ -237,12 +232,6 @@ def init_bold_t1_trans_wf(
 
 
     """
-    from niworkflows.engine.workflows import LiterateWorkflow as Workflow
-    from niworkflows.interfaces.fixes import FixHeaderApplyTransforms as ApplyTransforms
-    from niworkflows.interfaces.itk import MultiApplyTransforms
-    from niworkflows.interfaces.nibabel import GenerateSamplingReference
-    from niworkflows.interfaces.nilearn import Merge
-
     workflow = Workflow(name=name)
     inputnode = pe.Node(
         niu.IdentityInterface(
@@ -265,43 +254,36 @@ def init_bold_t1_trans_wf(
         name="outputnode",
     )
 
+    # Generate the sampling grid and resample the BOLD reference onto it
     gen_ref = pe.Node(
-        GenerateSamplingReference(), name="gen_ref", mem_gb=0.3
+        niu.Function(
+            function=_gen_ref_and_resample, output_names=["out_file", "out_ref"]
+        ),
+        name="gen_ref",
+        mem_gb=0.3,
     )  # 256x256x256 * 64 / 8 ~ 150MB
 
-    bold_ref_t1w_tfm = pe.Node(
-        ApplyTransforms(interpolation="LanczosWindowedSinc"), name="bold_ref_t1w_tfm", mem_gb=0.1
-    )
-
     # fmt:off
     workflow.connect([
-        (inputnode, gen_ref, [('ref_bold_brain', 'moving_image'),
-                              ('t1w_brain', 'fixed_image'),
-                              ('t1w_mask', 'fov_mask')]),
-        (inputnode, bold_ref_t1w_tfm, [('ref_bold_brain', 'input_image')]),
-        (gen_ref, bold_ref_t1w_tfm, [('out_file', 'reference_image')]),
-        (inputnode, bold_ref_t1w_tfm, [('bold2anat', 'transforms')]),
-        (bold_ref_t1w_tfm, outputnode, [('output_image', 'bold_t1_ref')]),
+        (inputnode, gen_ref, [('ref_bold_brain', 'ref_bold'),
+                              ('t1w_brain', 't1w'),
+                              ('t1w_mask', 't1w_mask'),
+                              ('bold2anat', 'bold2anat')]),
+        (gen_ref, outputnode, [('out_ref', 'bold_t1_ref')]),
     ])
     # fmt:on
 
     bold_to_t1w_transform = pe.Node(
-        MultiApplyTransforms(
-            interpolation="LanczosWindowedSinc", float=True, copy_dtype=True
-        ),
+        ResampleSeries(compress=use_compression),
         name="bold_to_t1w_transform",
-        mem_gb=mem_gb * 3 * omp_nthreads,
+        mem_gb=mem_gb + 0.2 * omp_nthreads,  # scratch of each thread
         n_procs=omp_nthreads,
     )
 
-    # merge 3D volumes into 4D timeseries
-    merge = pe.Node(Merge(compress=use_compression), name="merge", mem_gb=mem_gb)
-
     if not multiecho:
         # Merge transforms placing the head motion correction last
-        nforms = 2 + int(use_fieldwarp)
         merge_xforms = pe.Node(
-            niu.Merge(nforms),
+            niu.Function(function=_concat_xforms),
             name="merge_xforms",
             run_without_submitting=True,
             mem_gb=DEFAULT_MEMORY_MIN_GB,
@@ -309,42 +291,90 @@ def init_bold_t1_trans_wf(
         if use_fieldwarp:
             # fmt:off
             workflow.connect([
-                (inputnode, merge_xforms, [('fieldwarp', 'in2')])
+                (inputnode, merge_xforms, [('fieldwarp', 'fieldwarp')])
             ])
             # fmt:on
 
         # fmt:off
         workflow.connect([
-            # merge transforms
-            (inputnode, merge_xforms, [
-                ('hmc_xforms', 'in%d' % nforms),
-                ('bold2anat', 'in1')]),
+            (inputnode, merge_xforms, [('hmc_xforms', 'hmc_xforms'),
+                                       ('bold2anat', 'bold2anat')]),
             (merge_xforms, bold_to_t1w_transform, [('out', 'transforms')]),
-            (inputnode, bold_to_t1w_transform, [('bold_split', 'input_image')]),
         ])
         # fmt:on
     else:
-        from nipype.interfaces.fsl import Split as FSLSplit
-
-        bold_split = pe.Node(
-            FSLSplit(dimension="t"), name="bold_split", mem_gb=DEFAULT_MEMORY_MIN_GB
-        )
-
+        # HMC is already applied, so all volumes share the same transform
         # fmt:off
         workflow.connect([
-            (inputnode, bold_split, [('bold_split', 'in_file')]),
-            (bold_split, bold_to_t1w_transform, [('out_files', 'input_image')]),
             (inputnode, bold_to_t1w_transform, [('bold2anat', 'transforms')]),
         ])
         # fmt:on
 
     # fmt:off
     workflow.connect([
-        (inputnode, merge, [('name_source', 'header_source')]),
-        (gen_ref, bold_to_t1w_transform, [('out_file', 'reference_image')]),
-        (bold_to_t1w_transform, merge, [('out_files', 'in_files')]),
-        (merge, outputnode, [('out_file', 'bold_t1')]),
+        (inputnode, bold_to_t1w_transform, [('bold_split', 'in_file'),
+                                            ('name_source', 'header_source')]),
+        (gen_ref, bold_to_t1w_transform, [('out_file', 'ref_file')]),
+        (bold_to_t1w_transform, outputnode, [('out_file', 'bold_t1')]),
     ])
     # fmt:on
 
     return workflow
+
+
+def _concat_xforms(bold2anat, hmc_xforms, fieldwarp=None, anat2std=None):
+    """
+    Chain transforms as ANTs expects them (head-motion correction last).
+
+    >>> _concat_xforms("bold2anat.txt", "hmc.txt")
+    ['bold2anat.txt', 'hmc.txt']
+    >>> _concat_xforms("bold2anat.txt", ["hmc.txt"], fieldwarp="warp.nii.gz")
+    ['bold2anat.txt', 'warp.nii.gz', 'hmc.txt']
+    >>> _concat_xforms("bold2anat.txt", "hmc.txt", anat2std="anat2std.h5")
+    ['anat2std.h5', 'bold2anat.txt', 'hmc.txt']
+
+    """
+    from bids.utils import listify
+
+    return (
+        ([anat2std] if anat2std else [])
+        + [bold2anat]
+        + ([fieldwarp] if fieldwarp else [])
+        + listify(hmc_xforms)
+    )
+
+
+def _gen_ref_and_resample(ref_bold, t1w, t1w_mask, bold2anat):
+    """Generate the T1w-space sampling grid and map the BOLD reference onto it."""
+    import os
+    from nipype.utils.filemanip import fname_presuffix
+    from nitransforms.linear import load
+    from niworkflows.interfaces.nibabel import _gen_reference
+
+    out_file = _gen_reference(t1w, ref_bold, fov_mask=t1w_mask, newpath=os.getcwd())
+
+    xfm = load(bold2anat, fmt="itk", reference=out_file)
+    try:
+        from nitransforms.resampling import apply
+    except ImportError:  # nitransforms < 23.0
+        resampled = xfm.apply(ref_bold, order=3)
+    else:
+        resampled = apply(xfm, ref_bold, order=3)
+
+    out_ref = fname_presuffix(ref_bold, suffix="_space-T1w", newpath=os.getcwd())
+    resampled.to_filename(out_ref)
+    return out_file, out_ref
+
+
+def _fsl2itk(in_xfm, source_file, reference_file):
+    """Convert a FLIRT matrix and its inverse into ITK transforms."""
+    import os
+    from nitransforms.linear import load
+
+    xfm = load(in_xfm, fmt="fsl", reference=reference_file, moving=source_file)
+
+    itk_fwd = os.path.abspath("bold2anat_itk.txt")
+    itk_inv = os.path.abspath("anat2bold_itk.txt")
+    xfm.to_filename(itk_fwd, fmt="itk")
+    (~xfm).to_filename(itk_inv, fmt="itk")
+    return itk_fwd, itk_inv
@@ -9,11 +9,12 @@ Resampling workflows
 .. autofunction:: init_bold_preproc_trans_wf
 
 """
+from functools import lru_cache
+
 from ...config import DEFAULT_MEMORY_MIN_GB
 
 from nipype.pipeline import engine as pe
 from nipype.interfaces import utility as niu
-from nipype.interfaces.fsl import Split as FSLSplit
 import nipype.interfaces.workbench as wb
 
 
@@ -55,7 +56,8 @@ def init_bold_std_trans_wf(
     Parameters
     ----------
     mem_gb : :obj:`float`
-        Size of BOLD file in GB
+        Size of BOLD file in GB (the resampling node is sized from the
+        template grids instead, as the input series is not held in memory)
     omp_nthreads : :obj:`int`
         Maximum number of threads an individual process may use
     spaces : :py:class:`~niworkflows.utils.spaces.SpatialReferences`
@@ -81,8 +83,10 @@ def init_bold_std_trans_wf(
         spatial normalization.
     bold_mask
         Skull-stripping mask of reference image
+    bold_ref
+        BOLD reference image to which the series is aligned
     bold_split
-        Individual 3D volumes, not motion corrected
+        BOLD series (4D) or its individual 3D volumes, not motion corrected
     fieldwarp
         a :abbr:`DFM (displacements field map)` in ITK format
     hmc_xforms
@@ -110,12 +114,11 @@ def init_bold_std_trans_wf(
 
     """
     from niworkflows.engine.workflows import LiterateWorkflow as Workflow
-    from niworkflows.interfaces.fixes import FixHeaderApplyTransforms as ApplyTransforms
-    from niworkflows.interfaces.itk import MultiApplyTransforms
     from niworkflows.interfaces.utility import KeySelect
     from niworkflows.interfaces.nibabel import GenerateSamplingReference
-    from niworkflows.interfaces.nilearn import Merge
     from niworkflows.utils.spaces import format_reference
+    from ...interfaces.resampling import ResampleSeries
+    from .registration import _concat_xforms
 
     workflow = Workflow(name=name)
     output_references = spaces.cached.get_spaces(nonstandard=False, dim=(3,))
@@ -144,6 +147,7 @@ preprocessed BOLD runs*: {tpl}.
             fields=[
                 "anat2std_xfm",
                 "bold_mask",
+                "bold_ref",
                 "bold_split",
                 "fieldwarp",
                 "hmc_xforms",
@@ -156,10 +160,19 @@ preprocessed BOLD runs*: {tpl}.
     )
 
     iterablesource = pe.Node(
-        niu.IdentityInterface(fields=["std_target"]), name="iterablesource"
+        niu.IdentityInterface(fields=["std_target", "std_template"]),
+        name="iterablesource",
     )
     # Generate conversions for every template+spec at the input
-    iterablesource.iterables = [("std_target", std_vol_references)]
+    # (template images are resolved once, when the workflow is built)
+    std_templates = [
+        _resolve_template(name, _spec_items(spec)) for name, spec in std_vol_references
+    ]
+    iterablesource.iterables = [
+        ("std_target", std_vol_references),
+        ("std_template", std_templates),
+    ]
+    iterablesource.synchronize = True
 
     split_target = pe.Node(
         niu.Function(
@@ -177,81 +190,59 @@ preprocessed BOLD runs*: {tpl}.
         run_without_submitting=True,
     )
 
-    select_tpl = pe.Node(
-        niu.Function(function=_select_template),
-        name="select_tpl",
-        run_without_submitting=True,
-    )
-
     gen_ref = pe.Node(
         GenerateSamplingReference(), name="gen_ref", mem_gb=0.3
     )  # 256x256x256 * 64 / 8 ~ 150MB)
 
-    mask_std_tfm = pe.Node(
-        ApplyTransforms(interpolation="MultiLabel"), name="mask_std_tfm", mem_gb=1
-    )
-
-    ref_std_tfm = pe.Node(
-        ApplyTransforms(interpolation="LanczosWindowedSinc"), name="ref_std_tfm", mem_gb=1
-    )
-
-    # Write corrected file in the designated output dir
-    mask_merge_tfms = pe.Node(
-        niu.Merge(2),
-        name="mask_merge_tfms",
-        run_without_submitting=True,
-        mem_gb=DEFAULT_MEMORY_MIN_GB,
+    ref_mask_std_tfm = pe.Node(
+        niu.Function(
+            function=_resample_ref_mask,
+            output_names=["bold_std_ref", "bold_mask_std"],
+        ),
+        name="ref_mask_std_tfm",
+        mem_gb=1,
     )
 
-    nxforms = 3 + use_fieldwarp
+    # Merge transforms placing the head motion correction last
     merge_xforms = pe.Node(
-        niu.Merge(nxforms),
+        niu.Function(function=_concat_xforms),
         name="merge_xforms",
         run_without_submitting=True,
         mem_gb=DEFAULT_MEMORY_MIN_GB,
     )
-    workflow.connect([(inputnode, merge_xforms, [("hmc_xforms", "in%d" % nxforms)])])
-
     if use_fieldwarp:
-        workflow.connect([(inputnode, merge_xforms, [("fieldwarp", "in3")])])
+        workflow.connect([(inputnode, merge_xforms, [("fieldwarp", "fieldwarp")])])
 
+    # Share the threads among targets, so that MultiProc can run them concurrently
+    std_nprocs = max(1, omp_nthreads // max(1, len(std_vol_references)))
     bold_to_std_transform = pe.Node(
-        MultiApplyTransforms(
-            interpolation="LanczosWindowedSinc", float=True, copy_dtype=True
-        ),
+        ResampleSeries(compress=use_compression),
         name="bold_to_std_transform",
-        mem_gb=mem_gb * 3 * omp_nthreads,
-        n_procs=omp_nthreads,
+        mem_gb=_std_resampling_mem_gb(std_templates, std_nprocs),
+        n_procs=std_nprocs,
     )
 
-    merge = pe.Node(Merge(compress=use_compression), name="merge", mem_gb=mem_gb * 3)
-
     # fmt:off
     workflow.connect([
         (iterablesource, split_target, [('std_target', 'in_target')]),
-        (iterablesource, select_tpl, [('std_target', 'template')]),
         (inputnode, select_std, [('anat2std_xfm', 'anat2std_xfm'),
                                  ('templates', 'keys')]),
-        (inputnode, mask_std_tfm, [('bold_mask', 'input_image')]),
-        (inputnode, ref_std_tfm, [('bold_mask', 'input_image')]),
-        (inputnode, gen_ref, [(('bold_split', _first), 'moving_image')]),
-        (inputnode, merge_xforms, [
-            (('bold2anat', _aslist), 'in2')]),
-        (inputnode, merge, [('name_source', 'header_source')]),
-        (inputnode, mask_merge_tfms, [(('bold2anat', _aslist), 'in2')]),
-        (inputnode, bold_to_std_transform, [('bold_split', 'input_image')]),
+        (inputnode, ref_mask_std_tfm, [('bold_ref', 'bold_ref'),
+                                       ('bold_mask', 'bold_mask'),
+                                       ('bold2anat', 'bold2anat')]),
+        (inputnode, gen_ref, [('bold_ref', 'moving_image')]),
+        (inputnode, merge_xforms, [('bold2anat', 'bold2anat'),
+                                   ('hmc_xforms', 'hmc_xforms')]),
+        (inputnode, bold_to_std_transform, [('bold_split', 'in_file'),
+                                            ('name_source', 'header_source')]),
         (split_target, select_std, [('space', 'key')]),
-        (select_std, merge_xforms, [('anat2std_xfm', 'in1')]),
-        (select_std, mask_merge_tfms, [('anat2std_xfm', 'in1')]),
+        (select_std, merge_xforms, [('anat2std_xfm', 'anat2std')]),
+        (select_std, ref_mask_std_tfm, [('anat2std_xfm', 'anat2std')]),
         (split_target, gen_ref, [(('spec', _is_native), 'keep_native')]),
-        (select_tpl, gen_ref, [('out', 'fixed_image')]),
+        (iterablesource, gen_ref, [('std_template', 'fixed_image')]),
         (merge_xforms, bold_to_std_transform, [('out', 'transforms')]),
-        (gen_ref, bold_to_std_transform, [('out_file', 'reference_image')]),
-        (gen_ref, mask_std_tfm, [('out_file', 'reference_image')]),
-        (mask_merge_tfms, mask_std_tfm, [('out', 'transforms')]),
-        (gen_ref, ref_std_tfm, [('out_file', 'reference_image')]),
-        (mask_merge_tfms, ref_std_tfm, [('out', 'transforms')]),
-        (bold_to_std_transform, merge, [('out_files', 'in_files')]),
+        (gen_ref, bold_to_std_transform, [('out_file', 'ref_file')]),
+        (gen_ref, ref_mask_std_tfm, [('out_file', 'reference')]),
     ])
     # fmt:on
 
@@ -271,9 +262,9 @@ preprocessed BOLD runs*: {tpl}.
         # Connecting outputnode
         (iterablesource, poutputnode, [
             (('std_target', format_reference), 'spatial_reference')]),
-        (merge, poutputnode, [('out_file', 'bold_std')]),
-        (ref_std_tfm, poutputnode, [('output_image', 'bold_std_ref')]),
-        (mask_std_tfm, poutputnode, [('output_image', 'bold_mask_std')]),
+        (bold_to_std_transform, poutputnode, [('out_file', 'bold_std')]),
+        (ref_mask_std_tfm, poutputnode, [('bold_std_ref', 'bold_std_ref'),
+                                          ('bold_mask_std', 'bold_mask_std')]),
         (select_std, poutputnode, [('key', 'template')]),
     ])
     # fmt:on
@@ -283,6 +274,7 @@ preprocessed BOLD runs*: {tpl}.
         niu.IdentityInterface(fields=output_names),
         name="outputnode",
         joinsource="iterablesource",
+        run_without_submitting=True,
     )
     # fmt:off
     workflow.connect([
@@ -328,16 +320,16 @@ def init_bold_preproc_trans_wf(
     use_fieldwarp : :obj:`bool`
         Include SDC warp in single-shot transform from BOLD to MNI
     split_file : :obj:`bool`
-        Whether the input file should be splitted (it is a 4D file)
-        or it is a list of 3D files (default ``False``, do not split)
+        Ignored, kept for backwards compatibility: ``bold_file`` may be
+        a 4D series or a list of 3D volumes
     interpolation : :obj:`str`
-        Interpolation type to be used by ANTs' ``applyTransforms``
-        (default ``'LanczosWindowedSinc'``)
+        Interpolation type, named as in ANTs' ``applyTransforms``
+        (default ``'LanczosWindowedSinc'``, resampled with cubic B-splines)
 
     Inputs
     ------
     bold_file
-        Individual 3D volumes, not motion corrected
+        BOLD series (4D) or its individual 3D volumes, not motion corrected
     bold_mask
         Skull-stripping mask of reference image
     bold_ref
@@ -358,8 +350,7 @@ def init_bold_preproc_trans_wf(
     """
     from bids.utils import listify
     from niworkflows.engine.workflows import LiterateWorkflow as Workflow
-    from niworkflows.interfaces.itk import MultiApplyTransforms
-    from niworkflows.interfaces.nilearn import Merge
+    from ...interfaces.resampling import ResampleSeries
 
     workflow = Workflow(name=name)
     workflow.__desc__ = """\
@@ -387,43 +378,26 @@ the transforms to correct for head-motion"""
     outputnode = pe.Node(niu.IdentityInterface(fields=["bold"]), name="outputnode")
 
     bold_transform = pe.Node(
-        MultiApplyTransforms(interpolation=interpolation, float=True, copy_dtype=True),
+        ResampleSeries(
+            order={"NearestNeighbor": 0, "Linear": 1}.get(interpolation, 3),
+            compress=use_compression,
+        ),
         name="bold_transform",
-        mem_gb=mem_gb * 3 * omp_nthreads,
+        mem_gb=mem_gb + 0.2 * omp_nthreads,  # scratch of each thread
         n_procs=omp_nthreads,
     )
 
-    merge = pe.Node(Merge(compress=use_compression), name="merge", mem_gb=mem_gb * 3)
-
     # fmt:off
     workflow.connect([
-        (inputnode, merge, [('name_source', 'header_source')]),
-        (bold_transform, merge, [('out_files', 'in_files')]),
         (inputnode, bold_transform, [
+            ('bold_file', 'in_file'),
+            ('name_source', 'header_source'),
             (('hmc_xforms', listify), 'transforms'),
-            ('bold_ref', 'reference_image')]),
-        (merge, outputnode, [('out_file', 'bold')]),
+            ('bold_ref', 'ref_file')]),
+        (bold_transform, outputnode, [('out_file', 'bold')]),
     ])
     # fmt:on
 
-    # Input file is not splitted
-    if split_file:
-        bold_split = pe.Node(
-            FSLSplit(dimension="t"), name="bold_split", mem_gb=mem_gb * 3
-        )
-        # fmt:off
-        workflow.connect([
-            (inputnode, bold_split, [('bold_file', 'in_file')]),
-            (bold_split, bold_transform, [('out_files', 'input_image')])
-        ])
-        # fmt:on
-    else:
-        # fmt:off
-        workflow.connect([
-            (inputnode, bold_transform, [('bold_file', 'input_image')]),
-        ])
-        # fmt:on
-
     return workflow
 
 
@@ -477,7 +451,6 @@ def init_bold_grayords_wf(
         Density (i.e., either `91k` or `170k`) of ``cifti_bold``.
 
     """
-    import templateflow.api as tf
     from niworkflows.engine.workflows import LiterateWorkflow as Workflow
     from niworkflows.interfaces.cifti import GenerateCifti
     from niworkflows.interfaces.utility import KeySelect
@@ -547,42 +520,36 @@ surface space.
         ],
     )
     resample.inputs.current_sphere = [
-        str(tf.get("fsaverage", hemi=hemi, density="164k", desc="std", suffix="sphere"))
+        _tf_get("fsaverage", hemi=hemi, density="164k", desc="std", suffix="sphere")
         for hemi in "LR"
     ]
     resample.inputs.current_area = [
-        str(
-            tf.get(
-                "fsaverage",
-                hemi=hemi,
-                density="164k",
-                desc="vaavg",
-                suffix="midthickness",
-            )
+        _tf_get(
+            "fsaverage",
+            hemi=hemi,
+            density="164k",
+            desc="vaavg",
+            suffix="midthickness",
         )
         for hemi in "LR"
     ]
     resample.inputs.new_sphere = [
-        str(
-            tf.get(
-                "fsLR",
-                space="fsaverage",
-                hemi=hemi,
-                density=fslr_density,
-                suffix="sphere",
-            )
+        _tf_get(
+            "fsLR",
+            space="fsaverage",
+            hemi=hemi,
+            density=fslr_density,
+            suffix="sphere",
         )
         for hemi in "LR"
     ]
     resample.inputs.new_area = [
-        str(
-            tf.get(
-                "fsLR",
-                hemi=hemi,
-                density=fslr_density,
-                desc="vaavg",
-                suffix="midthickness",
-            )
+        _tf_get(
+            "fsLR",
+            hemi=hemi,
+            density=fslr_density,
+            desc="vaavg",
+            suffix="midthickness",
         )
         for hemi in "LR"
     ]
@@ -625,6 +592,54 @@ def _split_spec(in_target):
     return space, template, spec
 
 
+@lru_cache(maxsize=None)
+def _tf_get(template, **kwargs):
+    """Query TemplateFlow once per process for each file."""
+    import templateflow.api as tf
+
+    return str(tf.get(template, **kwargs))
+
+
+def _spec_items(spec):
+    """
+    Turn a space's spec into a hashable key for :func:`_resolve_template`.
+
+    >>> _spec_items({"res": 2, "cohort": [1, 2]})
+    (('cohort', (1, 2)), ('res', 2))
+
+    """
+    return tuple(
+        sorted((k, tuple(v) if isinstance(v, list) else v) for k, v in spec.items())
+    )
+
+
+@lru_cache(maxsize=None)
+def _resolve_template(name, spec_items):
+    """Cache :func:`_select_template` across workflows (e.g., several BOLD runs)."""
+    spec = {k: list(v) if isinstance(v, tuple) else v for k, v in spec_items}
+    return str(_select_template((name, spec)))
+
+
+def _std_resampling_mem_gb(ref_files, n_procs):
+    """
+    Estimate the memory (GB) taken by mapping a series onto template grids.
+
+    The sampling reference is taken to be no larger than the largest template
+    grid (native-resolution targets keep the coarser BOLD resolution).
+    The grid points are mapped once through the nonlinear transforms
+    (4 float64 per voxel, shared by all threads), and each thread holds
+    its voxel coordinates (3 float64 per voxel) and resampled volume
+    (float32), plus 0.2 GB for a spline-prefiltered copy of the input volume.
+    The output series is memory-mapped.
+
+    """
+    import numpy as np
+    import nibabel as nb
+
+    nvox = max((np.prod(nb.load(f).shape[:3]) for f in ref_files), default=0)
+    return (32 + 28 * n_procs) * int(nvox) / 1024 ** 3 + 0.2 * n_procs
+
+
 def _select_template(template):
     from fprodents.patch.utils import get_template_specs
 
@@ -652,18 +667,58 @@ def _select_template(template):
     return out[0]
 
 
-def _first(inlist):
-    return inlist[0]
+def _is_native(in_value):
+    return in_value.get("resolution") == "native" or in_value.get("res") == "native"
 
 
-def _aslist(in_value):
-    if isinstance(in_value, list):
-        return in_value
-    return [in_value]
+def _resample_ref_mask(bold_ref, bold_mask, reference, anat2std, bold2anat):
+    """
+    Map the BOLD reference and mask onto the reference grid.
 
+    The chain ``[anat2std, bold2anat]`` is evaluated once for both images.
+    The reference is interpolated with cubic B-splines (written as ``float32``),
+    and the mask with nearest-neighbor (keeping its data type).
 
-def _is_native(in_value):
-    return in_value.get("resolution") == "native" or in_value.get("res") == "native"
+    """
+    import os
+    import numpy as np
+    import nibabel as nb
+    from scipy import ndimage as ndi
+    from nipype.utils.filemanip import fname_presuffix
+    from bids.utils import listify
+    from fprodents.interfaces.resampling import _load_transform
+
+    ref = nb.load(reference)
+
+    # Trailing affines are composed with the world-to-voxel matrix of each input
+    transforms = listify(anat2std) + listify(bold2anat)
+    xfms = [_load_transform(fname) for fname in transforms]
+    composed = np.eye(4)
+    while xfms and (xfms[-1] is None or hasattr(xfms[-1], "matrix")):
+        xfm = xfms.pop()
+        if xfm is not None:
+            composed = composed @ xfm.matrix
+
+    ijk = np.indices(ref.shape[:3]).reshape(3, -1).T
+    points = nb.affines.apply_affine(ref.affine, ijk)
+    for xfm in xfms:
+        if xfm is not None:
+            points = xfm.map(points)
+
+    out_files = []
+    for in_file, order in ((bold_ref, 3), (bold_mask, 0)):
+        img = nb.load(in_file)
+        coords = nb.affines.apply_affine(np.linalg.inv(img.affine) @ composed, points)
+        data = np.asanyarray(img.dataobj) if order == 0 else img.get_fdata()
+        resampled = ndi.map_coordinates(
+            data, coords.T, order=order, mode="constant", cval=0
+        ).reshape(ref.shape[:3])
+
+        out_img = nb.Nifti1Image(resampled, ref.affine, ref.header)
+        out_img.set_data_dtype(img.get_data_dtype() if order == 0 else np.float32)
+        out_files.append(fname_presuffix(in_file, suffix="_trans", newpath=os.getcwd()))
+        out_img.to_filename(out_files[-1])
+    return tuple(out_files)
 
 
 def _itk2lta(in_file, src_file, dst_file):
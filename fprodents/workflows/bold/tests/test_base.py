@@ -0,0 +1,108 @@
+""" Testing module for fprodents.workflows.bold.base """
+import json
+
+import pytest
+from bids.layout import BIDSLayout
+
+from ..base import index_sbrefs, _get_metadata, _lookup_sbrefs
+
+FILES = [
+    "sub-01/func/sub-01_task-rest_run-1_bold.nii.gz",
+    "sub-01/func/sub-01_task-rest_run-1_sbref.nii.gz",
+    "sub-01/func/sub-01_task-rest_run-2_bold.nii.gz",
+    "sub-01/func/sub-01_task-rest_run-2_sbref.nii",
+    "sub-01/func/sub-01_task-rest_acq-mb_run-1_bold.nii.gz",
+    "sub-01/func/sub-01_task-nosbref_bold.nii.gz",
+    "sub-01/ses-1/func/sub-01_ses-1_task-rest_bold.nii.gz",
+    "sub-01/ses-1/func/sub-01_ses-1_task-rest_sbref.nii.gz",
+    "sub-01/ses-1/func/sub-01_ses-1_task-rest_acq-mb_sbref.nii.gz",
+    "sub-01/func/sub-01_task-me_echo-1_bold.nii.gz",
+    "sub-01/func/sub-01_task-me_echo-2_bold.nii.gz",
+    "sub-01/func/sub-01_task-me_echo-3_bold.nii.gz",
+    "sub-01/func/sub-01_task-me_echo-1_sbref.nii.gz",
+    "sub-01/func/sub-01_task-me_echo-2_sbref.nii.gz",
+    "sub-01/func/sub-01_task-me_echo-3_sbref.nii.gz",
+    "sub-02/func/sub-02_task-rest_run-1_sbref.nii.gz",
+]
+
+
+@pytest.fixture(scope="module")
+def layout(tmp_path_factory):
+    root = tmp_path_factory.mktemp("bids")
+    (root / "dataset_description.json").write_text(
+        json.dumps({"Name": "sbrefs", "BIDSVersion": "1.6.0"})
+    )
+    for fname in FILES:
+        (root / fname).parent.mkdir(parents=True, exist_ok=True)
+        (root / fname).touch()
+    return BIDSLayout(str(root), validate=False)
+
+
+def _layout_query(layout, entities):
+    """The per-run query that the index replaces."""
+    entities = dict(entities, suffix="sbref", extension=["nii", "nii.gz"])
+    return sorted(layout.get(return_type="file", **entities))
+
+
+@pytest.mark.parametrize(
+    "echoes", [None, [1], [1, 2, 3]], ids=["single-echo", "one-echo", "multi-echo"]
+)
+def test_lookup_sbrefs(layout, echoes):
+    sbref_index = index_sbrefs(layout, "01")
+    assert all(
+        "sub-02" not in sbref for sbrefs in sbref_index.values() for _, sbref in sbrefs
+    )
+
+    bold_files = layout.get(subject="01", suffix="bold", return_type="file")
+    if echoes is not None:
+        bold_files = [f for f in bold_files if "task-me" in f]
+    assert bold_files
+
+    for bold_file in bold_files:
+        entities = layout.parse_file_entities(bold_file)
+        if echoes is None:
+            entities.pop("echo", None)
+        elif len(echoes) > 1:
+            entities["echo"] = echoes
+        else:
+            entities["echo"] = echoes[0]
+        assert _lookup_sbrefs(sbref_index, entities) == _layout_query(
+            layout, entities
+        ), bold_file
+
+
+def test_lookup_sbrefs_cases(layout):
+    sbref_index = index_sbrefs(layout, "01")
+
+    def _lookup(bold_file):
+        return [
+            sbref.split("/")[-1]
+            for sbref in _lookup_sbrefs(
+                sbref_index, layout.parse_file_entities(bold_file)
+            )
+        ]
+
+    root = layout.root
+    assert _lookup(f"{root}/{FILES[2]}") == ["sub-01_task-rest_run-2_sbref.nii"]
+    assert _lookup(f"{root}/{FILES[4]}") == []
+    assert _lookup(f"{root}/{FILES[5]}") == []
+    assert _lookup(f"{root}/{FILES[10]}") == ["sub-01_task-me_echo-2_sbref.nii.gz"]
+
+
+def test_get_metadata(tmp_path):
+    (tmp_path / "dataset_description.json").write_text(
+        json.dumps({"Name": "metadata", "BIDSVersion": "1.6.0"})
+    )
+    bold_file = tmp_path / "sub-01" / "func" / "sub-01_task-rest_bold.nii.gz"
+    bold_file.parent.mkdir(parents=True)
+    bold_file.touch()
+    sidecar = tmp_path / "sub-01" / "func" / "sub-01_task-rest_bold.json"
+
+    sidecar.write_text(json.dumps({"RepetitionTime": 1.0}))
+    layout = BIDSLayout(str(tmp_path), validate=False)
+    assert _get_metadata(layout, str(bold_file))["RepetitionTime"] == 1.0
+
+    # A rebuilt layout does not get the metadata cached for the previous one
+    sidecar.write_text(json.dumps({"RepetitionTime": 2.0}))
+    new_layout = BIDSLayout(str(tmp_path), validate=False)
+    assert _get_metadata(new_layout, str(bold_file))["RepetitionTime"] == 2.0
@@ -1,9 +1,17 @@
 """ Testing module for fprodents.workflows.bold.confounds """
 import pytest
 import os
+import numpy as np
 import nibabel as nib
 
-from ..confounds import _add_volumes, _remove_volumes
+from ..confounds import (
+    _add_volumes,
+    _remove_volumes,
+    _pack_rois,
+    _unpack_rois,
+    _framewise_displacement,
+    _stage_bold,
+)
 
 
 skip_pytest = pytest.mark.skipif(
@@ -49,3 +57,76 @@ def test_add_volumes():
     os.remove(add_file)
 
     assert out_volumes == expected_volumes
+
+
+def test_no_nonsteady_volumes(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    bold_file = str(tmp_path / "bold.nii.gz")
+    # Without non steady state volumes, the series is passed through unread
+    assert _remove_volumes(bold_file, 0) == bold_file
+    assert _add_volumes(bold_file, "cut.nii.gz", 0) == "cut.nii.gz"
+    assert not list(tmp_path.iterdir())
+
+
+def test_stage_bold(tmp_path, monkeypatch):
+    data = np.random.default_rng(0).uniform(0, 1000, size=(5, 5, 5, 3))
+    img = nib.Nifti1Image(data.astype(np.float32), np.eye(4))
+    img.set_data_dtype(np.int16)
+    in_file = str(tmp_path / "bold.nii.gz")
+    img.to_filename(in_file)
+    img = nib.load(in_file)
+
+    (tmp_path / "work").mkdir()
+    monkeypatch.chdir(tmp_path / "work")
+    out_file = _stage_bold(in_file)
+    assert out_file == str(tmp_path / "work" / "bold.nii")
+    out_img = nib.load(out_file)
+    assert out_img.get_data_dtype() == np.int16
+    assert out_img.dataobj.slope == img.dataobj.slope
+    assert np.array_equal(out_img.get_fdata(), img.get_fdata())
+    assert _stage_bold(out_file) == out_file
+
+
+def test_pack_unpack_rois(tmp_path, monkeypatch):
+    in_dir = tmp_path / "inputs"
+    in_dir.mkdir()
+    rois = []
+    for i in range(4):
+        roidata = np.zeros((5, 5, 5), dtype=np.float32)
+        roidata[i:i + 2, 1:4, 1:4] = 1
+        rois.append(roidata)
+        nib.Nifti1Image(roidata, np.eye(4)).to_filename(in_dir / f"roi{i}.nii.gz")
+
+    mskdata = np.zeros((5, 5, 5), dtype=np.uint8)
+    mskdata[2:, ...] = 1
+    msk_file = in_dir / "mask.nii.gz"
+    nib.Nifti1Image(mskdata, np.eye(4)).to_filename(msk_file)
+
+    # Outputs are written in the working directory, not next to the inputs
+    monkeypatch.chdir(tmp_path)
+    packed = _pack_rois([str(in_dir / f"roi{i}.nii.gz") for i in range(4)])
+    out_files = _unpack_rois(str(msk_file), packed)
+    assert os.path.dirname(packed) == str(tmp_path)
+
+    assert len(out_files) == 4
+    for roidata, out_file in zip(rois, out_files):
+        assert os.path.dirname(out_file) == str(tmp_path)
+        out_img = nib.load(out_file)
+        assert out_img.get_data_dtype() == np.uint8
+        expected = roidata.astype(np.uint8)
+        expected[:2, ...] = 0
+        assert np.array_equal(np.asanyarray(out_img.dataobj), expected)
+
+
+def test_framewise_displacement(tmp_path, monkeypatch):
+    from nipype.algorithms.confounds import FramewiseDisplacement
+
+    monkeypatch.chdir(tmp_path)
+    movpar = np.random.default_rng(0).standard_normal((20, 6)) * 0.01
+    np.savetxt("movpar.txt", movpar)
+
+    expected = FramewiseDisplacement(
+        in_file="movpar.txt", parameter_source="SPM", out_file="nipype_fd.txt"
+    ).run().outputs.out_file
+    with open(expected) as ref, open(_framewise_displacement("movpar.txt")) as out:
+        assert out.read() == ref.read()
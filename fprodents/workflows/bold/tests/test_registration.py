@@ -0,0 +1,81 @@
+""" Testing module for fprodents.workflows.bold.registration """
+import numpy as np
+import nibabel as nib
+import pytest
+
+from ..registration import _fsl2itk
+
+LPS = np.diag([-1.0, -1.0, 1.0, 1.0])
+
+
+def _fsl_scaling(img):
+    """Voxel-to-FSL (scaled, possibly x-flipped voxel) coordinates."""
+    zooms = np.array(img.header.get_zooms()[:3])
+    scaling = np.diag(list(zooms) + [1.0])
+    if np.linalg.det(img.affine[:3, :3]) > 0:
+        flip = np.eye(4)
+        flip[0, 0] = -1
+        flip[0, 3] = img.shape[0] - 1
+        scaling = scaling @ flip
+    return scaling
+
+
+def _read_itk(fname):
+    """Read an ITK affine file as a 4x4 (LPS) matrix, without NiTransforms."""
+    fields = dict(
+        line.split(": ", 1) for line in open(fname).read().splitlines() if ": " in line
+    )
+    params = np.array(fields["Parameters"].split(), dtype=float)
+    center = np.array(fields["FixedParameters"].split(), dtype=float)
+    matrix = np.eye(4)
+    matrix[:3, :3] = params[:9].reshape(3, 3)
+    matrix[:3, 3] = params[9:] + center - matrix[:3, :3] @ center
+    return matrix
+
+
+@pytest.mark.parametrize("moving_orientation", ["RAS", "LAS"])
+def test_fsl2itk(tmp_path, monkeypatch, moving_orientation):
+    moving_affine = np.array(
+        [[0.3, 0, 0, -3.0], [0, 0.3, 0, -4.2], [0, 0, 0.6, -5.1], [0, 0, 0, 1]]
+    )
+    if moving_orientation == "LAS":
+        moving_affine[0] *= -1
+    moving = nib.Nifti1Image(np.zeros((20, 28, 16), dtype="uint8"), moving_affine)
+    reference = nib.Nifti1Image(
+        np.zeros((40, 44, 36), dtype="uint8"),
+        np.array(
+            [[0.2, 0, 0, -4.0], [0, 0.2, 0, -4.4], [0, 0, 0.2, -3.6], [0, 0, 0, 1]]
+        ),
+    )
+    moving.to_filename(tmp_path / "bold.nii.gz")
+    reference.to_filename(tmp_path / "t1w.nii.gz")
+
+    # Moves the BOLD (moving) world coordinates into alignment with the T1w
+    theta = np.deg2rad(5)
+    bold2anat = np.array(
+        [
+            [np.cos(theta), -np.sin(theta), 0, 0.5],
+            [np.sin(theta), np.cos(theta), 0, -0.3],
+            [0, 0, 1, 0.8],
+            [0, 0, 0, 1],
+        ]
+    )
+    fsl = (
+        _fsl_scaling(reference)
+        @ np.linalg.inv(reference.affine)
+        @ bold2anat
+        @ moving.affine
+        @ np.linalg.inv(_fsl_scaling(moving))
+    )
+    np.savetxt(tmp_path / "bold2anat.mat", fsl)
+
+    monkeypatch.chdir(tmp_path)
+    itk_fwd, itk_inv = _fsl2itk(
+        str(tmp_path / "bold2anat.mat"),
+        str(tmp_path / "bold.nii.gz"),
+        str(tmp_path / "t1w.nii.gz"),
+    )
+
+    # ITK transforms map points of the fixed image onto the moving image (LPS)
+    assert np.allclose(_read_itk(itk_fwd), LPS @ np.linalg.inv(bold2anat) @ LPS)
+    assert np.allclose(_read_itk(itk_inv), LPS @ bold2anat @ LPS)